@@ -31,24 +31,37 @@ reverse DNS) using the RIPEStat API, with a basic cache to avoid flood of
 requests and to enhance performance."""
 
 
+import gzip
 import os.path
 import time
+import itertools
 import json
+import re
 import socket
+import threading
+import weakref
 
 try:
     # For Python 3.0 and later
-    from urllib.request import urlopen
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
 except ImportError:
     # Fall back to Python 2's urllib2
-    from urllib2 import urlopen
+    from urllib2 import HTTPError, Request, urlopen
 
 try:
-    import ipaddr  # http://code.google.com/p/ipaddr-py/ - pip install ipaddr
-    ip_library = 'ipaddr'
-except ImportError:
-    import IPy     # https://github.com/autocracy/python-ipy/ - pip install ipy
-    ip_library = 'IPy'
+    # Python 2: str and unicode
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+from .addresses import SPECIAL_PURPOSE, AddressNormaliser, PrefixTable, \
+                       format_ip, is_globally_routable, netmask, parse_ip, \
+                       parse_prefix
+from .calls import Call
+from .indexes import CacheIndexes
+from .records import FIELDS, IPInformation
+from .ttl import changed as ttl_changed
 
 
 class IPDetailsCacheError(Exception):
@@ -59,56 +72,60 @@ class IPDetailsCacheIXPInformationError(IPDetailsCacheError):
     pass
 
 
+# Fields of GetIPInformation results
+FIELDS_PROFILES = {
+    "full": frozenset(FIELDS),
+    "asn": frozenset(["TS", "ASN", "Holder", "Prefix"])
+}
+
+# Lanes of GetIPInformation lookups (see the scheduler module), from the
+# highest to the lowest priority
+LANES = ("interactive", "bulk", "refresh")
+
+# Whitespace allowed between JSON tokens
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# Format of the files written by ExportSnapshot
+SNAPSHOT_FORMAT = "ipdetailscache-snapshot"
+SNAPSHOT_VERSION = 1
+
+# Result of lookups of addresses that are not globally routable
+UNKNOWN = IPInformation(ASN="unknown")
+
+# Result of lookups that time out before anything is known about the address
+PENDING = IPInformation(ASN="pending", HostName=None)
+
+
 class IPWrapper():
+    # Legacy wrapper, now built on the addresses module: ip_object is the
+    # (version, value) key of the address.
 
     def __init__(self, ip):
-        if ip_library == 'ipaddr':
-            self.ip_object = ipaddr.IPAddress(ip)
-        else:
-            self.ip_object = IPy.IP(ip)
+        self.ip_object = parse_ip(str(ip))
 
     def get_version(self):
-        if ip_library == 'ipaddr':
-            return self.ip_object.version
-        else:
-            return self.ip_object.version()
+        return self.ip_object[0]
 
     def is_globally_routable(self):
-        if ip_library == 'ipaddr':
-            if self.get_version() == 4:
-                return not self.ip_object.is_private
-            else:
-                return not (self.ip_object.is_private or
-                            self.ip_object.is_reserved or
-                            self.ip_object.is_link_local or
-                            self.ip_object.is_site_local or
-                            self.ip_object.is_unspecified)
-        else:
-            return self.ip_object.iptype() not in ['RESERVED', 'UNSPECIFIED',
-                                                   'LOOPBACK', 'UNASSIGNED',
-                                                   'DOCUMENTATION', 'ULA',
-                                                   'LINKLOCAL', 'PRIVATE']
+        # The IANA special-purpose address space (addresses.SPECIAL_PURPOSE)
+        return is_globally_routable(self.ip_object)
 
     def exploded(self):
-        if ip_library == 'ipaddr':
-            return self.ip_object.exploded
-        else:
-            return self.ip_object.strFullsize()
+        return format_ip(self.ip_object)
 
 
 class NetWrapper():
+    # Legacy wrapper, now built on the addresses module: net_object is the
+    # (version, network, length) tuple of the prefix.
 
     def __init__(self, prefix):
-        if ip_library == 'ipaddr':
-            self.net_object = ipaddr.IPNetwork(prefix)
-        else:
-            self.net_object = IPy.IP(prefix)
+        self.net_object = parse_prefix(str(prefix))
 
     def contains(self, ip_obj):
-        if ip_library == 'ipaddr':
-            return self.net_object.Contains(ip_obj.ip_object)
-        else:
-            return ip_obj.ip_object in self.net_object
+        version, network, length = self.net_object
+        key = ip_obj.ip_object
+        return key[0] == version and \
+            key[1] & netmask(version, length) == network
 
 
 class IPDetailsCache():
@@ -119,31 +136,97 @@ class IPDetailsCache():
 
     URL = "https://stat.ripe.net/data/prefix-overview/data.json?resource={}"
 
+    # Number of entries merged at once when the cache is loaded in
+    # background (lazy_load).
+    LOAD_CHUNK_SIZE = 10000
+
     def _Debug(self, s):
         if self.Debug:
             print("DEBUG - IPDetailsCache - %s" % s)
 
     @staticmethod
-    def _read_from_url(url):
-        response = urlopen(url)
+    def _urlopen_kwargs(timeout):
+        # urlopen's default timeout is the socket module's one, which is
+        # not the same as timeout=None.
+        return {} if timeout is None else {"timeout": timeout}
+
+    @staticmethod
+    def _read_from_url(url, timeout=None):
+        response = urlopen(url, **IPDetailsCache._urlopen_kwargs(timeout))
         return response.read().decode("utf-8")
 
+    @staticmethod
+    def _open_url(url, headers=None, timeout=None):
+        # Return (status, headers, body); body is None when the server
+        # replies with 304 (not modified) to a conditional request.
+        try:
+            response = urlopen(Request(url, headers=headers or {}),
+                               **IPDetailsCache._urlopen_kwargs(timeout))
+        except HTTPError as e:
+            if e.code == 304:
+                return 304, e.info(), None
+            raise
+        return response.getcode(), response.info(), \
+            response.read().decode("utf-8")
+
+    def _open(self, url, headers=None):
+        # Return (status, headers, body), using the transport if set.
+        if self.Transport:
+            return self.Transport.open(url, headers, self.FetchTimeout)
+        return self._open_url(url, headers, self.FetchTimeout)
+
     def FetchIPInfo(self, IP):
         self._Debug("Fetching info for {} from RIPEStat API".format(IP))
         url = IPDetailsCache.URL.format(IP)
-        return json.loads(self._read_from_url(url))
+        if self.Transport:
+            return json.loads(self._open(url)[2])
+        return json.loads(self._read_from_url(url, self.FetchTimeout))
 
     # IPPrefixesCache[<ip prefix>]["TS"]
     # IPPrefixesCache[<ip prefix>]["ASN"]
     # IPPrefixesCache[<ip prefix>]["Holder"]
 
-    # IPAddressesCache[<ip>]["TS"]
-    # IPAddressesCache[<ip>]["ASN"]
-    # IPAddressesCache[<ip>]["Holder"]
-    # IPAddressesCache[<ip>]["Prefix"]
-    # IPAddressesCache[<ip>]["HostName"]
+    # IPAddressesCache[<(version, value)>].TS
+    # IPAddressesCache[<(version, value)>].ASN
+    # IPAddressesCache[<(version, value)>].Holder
+    # IPAddressesCache[<(version, value)>].Prefix
+    # IPAddressesCache[<(version, value)>].HostName
+    # IPAddressesCache[<(version, value)>].IsIXP
+    # IPAddressesCache[<(version, value)>].IXPName
 
-    def _enrich_with_ixp_info(self, IPObj, Result):
+    def _index_prefix(self, IPPrefix):
+        try:
+            self.IPPrefixesIndex.add(IPPrefix, IPPrefix)
+        except ValueError:
+            self._Debug("Can't index prefix %s" % IPPrefix)
+
+    def _rebuild_prefixes_index(self):
+        index = PrefixTable()
+        for IPPrefix in self.IPPrefixesCache:
+            try:
+                index.add(IPPrefix, IPPrefix)
+            except ValueError:
+                self._Debug("Can't index prefix %s" % IPPrefix)
+        self.IPPrefixesIndex = index
+
+    def _get_ixps_index(self):
+        # IXPsCache may be replaced as a whole (UseIXPs, LoadIXPsCache):
+        # the index is rebuilt whenever its "Data" dict changes. Values are
+        # (prefix, IXP name), so that lookups don't read IXPsCache, which
+        # may be replaced in the meantime.
+        data = self.IXPsCache.get("Data", {})
+        if self._ixps_index_data is not data:
+            index = PrefixTable()
+            for IPPrefix, ixp in data.items():
+                try:
+                    index.add(IPPrefix, (IPPrefix, ixp["name"]))
+                except ValueError:
+                    self._Debug("Can't index IXP prefix %s" % IPPrefix)
+            self._ixps_index = index
+            self._ixps_index_data = data
+        return self._ixps_index
+
+    def _enrich_with_ixp_info(self, key, Result):
         if Result["IsIXP"] is not None:
             # cached address already enriched with IXPs info
             return
@@ -155,212 +238,953 @@ class IPDetailsCache():
 
             Result["IsIXP"] = False
 
-            for IPPrefix in self.IXPsCache["Data"].keys():
-                if NetWrapper(IPPrefix).contains(IPObj):
-                    Result["IsIXP"] = True
-                    Result["IXPName"] = \
-                        self.IXPsCache["Data"][IPPrefix]["name"]
+            ixp = self._get_ixps_index().lookup(key)
+            if ixp is not None:
+                IPPrefix, Result["IXPName"] = ixp
+                Result["IsIXP"] = True
+                self._Debug(
+                    "IXP found: prefix {}, name {}".format(
+                        IPPrefix, Result["IXPName"]
+                    )
+                )
+
+    @staticmethod
+    def _get_fields(fields):
+        if isinstance(fields, _string_types):
+            if fields not in FIELDS_PROFILES:
+                raise ValueError("Unknown fields profile: {}".format(fields))
+            return FIELDS_PROFILES[fields]
+        fields = frozenset(fields)
+        for field in fields:
+            if field not in FIELDS_PROFILES["full"]:
+                raise ValueError("Unknown field: {}".format(field))
+        return fields
+
+    @staticmethod
+    def _resolve_hostname(IP):
+        HostName = socket.getfqdn(IP)
+        if HostName == IP or HostName == "":
+            return "unknown"
+        return HostName
+
+    def _needs_ixp_info(self, Address):
+        return Address.IsIXP is None and (
+            self.UseIXPsCache == 2 or
+            (self.UseIXPsCache == 1 and not Address.ASN.isdigit())
+        )
+
+    def _call_in_background(self, key, func, *args):
+        # Calls with the same key share the same in-flight Call: lookups
+        # that give up waiting for it leave it running, and the ones that
+        # follow join it.
+        with self._lock:
+            call = self._inflight.get(key)
+            if call is None:
+                call = Call(func, args,
+                            name="IPDetailsCache {}".format(key[0]),
+                            on_done=lambda: self._inflight_done(key))
+                self._inflight[key] = call
+                call.start()
+        return call
+
+    def _inflight_done(self, key):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def _get_hostname(self, IP, deadline):
+        # Return None if the deadline expires before reverse DNS resolves.
+        if deadline is None:
+            return self._resolve_hostname(IP)
+
+        call = self._call_in_background(("dns", IP), self._resolve_hostname,
+                                        IP)
+        if not call.wait(max(0, deadline - time.time())):
+            self._Debug("Reverse DNS timeout for %s" % IP)
+            return None
+        return call.result()
+
+    def _fetch(self, IP):
+        if self.RateLimiter:
+            self.RateLimiter.acquire()
+        return self.FetchIPInfo(IP)
+
+    def _hedged_fetch(self, IP):
+        # When the response doesn't arrive within HedgeDelay seconds a
+        # second request is sent: the first response is used, the slower
+        # one is discarded.
+        if not self.HedgeDelay:
+            return self._fetch(IP)
+
+        call = Call(self._fetch, (IP,), name="IPDetailsCache fetch")
+        call.start()
+        if not call.wait(self.HedgeDelay) and call.start():
+            self._Debug("Hedged request sent for %s" % IP)
+        call.wait()
+        return call.result()
+
+    def _schedule_fetch(self, IP, StalePrefix, previous, lane):
+        # Fetches are deduplicated by prefix: lookups of addresses of the
+        # same expired prefix share one fetch. The scheduler may be shared
+        # among caches, each one needing its own fetches: keys include the
+        # cache (alive, and its id unique, while its calls are queued or
+        # running).
+        if StalePrefix is not None:
+            key = (id(self), "prefix", StalePrefix)
+        else:
+            key = (id(self), "fetch", IP)
+        return self.Scheduler.submit(key, self._fetch_prefix_info,
+                                     (IP, True, previous),
+                                     lane or "interactive")
+
+    @staticmethod
+    def _wait_fetch(call, deadline):
+        # Return the result of a background fetch, or None if the deadline
+        # expires first.
+        if not call.wait(None if deadline is None
+                         else max(0, deadline - time.time())):
+            return None
+        return call.result()
+
+    @staticmethod
+    def _prefix_contains(IPPrefix, key):
+        try:
+            version, network, length = parse_prefix(IPPrefix)
+        except ValueError:
+            return False
+        return version == key[0] and \
+            key[1] & netmask(version, length) == network
+
+    def _apply_ttl_policy(self, IPPrefix, entry, old, previous):
+        # Must be called with self._lock held. Set the TTL of a new prefix
+        # entry (and the other keys stored by the policy) and update the
+        # TTL stats. previous is what was known about the address before
+        # the fetch, if anything.
+        if previous is None and old is not None:
+            previous = dict(old, Prefix=IPPrefix)
+
+        new = dict(entry, Prefix=IPPrefix)
+        TTL = self.TTLPolicy.ttl(previous, new)
+        del new["Prefix"]
+        entry.update(new)
+        entry["TTL"] = TTL
+
+        self._fold_saved_fetches(IPPrefix, old)
+
+        if previous is not None:
+            self._ttl_stats["Refreshes"] += 1
+            if ttl_changed(previous, dict(entry, Prefix=IPPrefix)):
+                self._ttl_stats["Changes"] += 1
+            if previous["TS"] >= entry["TS"] - self.MAX_CACHE:
+                self._ttl_stats["ExtraFetches"] += 1
+
+        return TTL
+
+    def _fold_saved_fetches(self, IPPrefix, old):
+        # Must be called with self._lock held, when the entry old of
+        # IPPrefix is replaced or removed: the fetches it saved are counted
+        # for good. A marker written by a lookup that raced with a previous
+        # replacement belongs to an older entry and is dropped, since its
+        # fetches have already been counted.
+        marker = self._saved_fetches.pop(IPPrefix, None)
+        if marker is not None and old is not None and marker[0] == old["TS"]:
+            self._ttl_stats["SavedFetches"] += marker[2]
+
+    def _count_saved_fetch(self, IPPrefix, TS, now):
+        # A lookup answered by the entry of IPPrefix fetched at TS, older
+        # than MAX_CACHE thanks to the TTL policy. Without the policy the
+        # entry would have been fetched again once per MAX_CACHE period:
+        # one fetch is counted for each period with at least one lookup.
+        # No lock is taken: the (TS, period, count) marker of the prefix is
+        # only counted while it matches the TS of the prefix entry (see
+        # _fold_saved_fetches), and concurrent lookups in the same period
+        # write the same marker. Address entries older than the prefix one
+        # don't save fetches: without the policy they would be answered by
+        # the newer prefix entry.
+        if self.MAX_CACHE <= 0:
+            return
+        current = self.IPPrefixesCache.get(IPPrefix)
+        if current is None or current["TS"] != TS:
+            return
+        period = int((now - TS) // self.MAX_CACHE)
+        marker = self._saved_fetches.get(IPPrefix)
+        if marker is None or marker[0] < TS:
+            self._saved_fetches[IPPrefix] = (TS, period, 1)
+        elif marker[0] == TS and marker[1] < period:
+            self._saved_fetches[IPPrefix] = (TS, period, marker[2] + 1)
+
+    def GetTTLStats(self):
+        """Return the stats of the TTL policy, as a dict:
+
+        - Refreshes, fetches of addresses whose details were known (but
+          expired);
+        - Changes, refreshes that found a different ASN, Holder or Prefix;
+        - SavedFetches, fetches that would have been needed without the
+          policy: one for each MAX_CACHE period in which an entry older
+          than MAX_CACHE answered lookups;
+        - ExtraFetches, refreshes of entries younger than MAX_CACHE, that
+          would not have been fetched without the policy."""
+        with self._lock:
+            stats = dict(self._ttl_stats)
+            for IPPrefix, marker in list(self._saved_fetches.items()):
+                current = self.IPPrefixesCache.get(IPPrefix)
+                if current is not None and current["TS"] == marker[0]:
+                    stats["SavedFetches"] += marker[2]
+            return stats
+
+    def _fetch_prefix_info(self, IP, count_changes=True, previous=None):
+        # Fetch TS, ASN, Holder and Prefix of IP from RIPEStat; the prefix
+        # is added to the prefixes cache. With count_changes False the
+        # caller counts the change, together with its own ones. previous
+        # is passed to the TTL policy.
+        obj = self._hedged_fetch(IP)
+
+        Info = {"TS": 0, "ASN": "", "Holder": "", "Prefix": ""}
+
+        if obj["status"] == "ok":
+            Info["TS"] = int(time.time())
+
+            if obj["data"]["asns"] != []:
+                try:
+                    Info["ASN"] = str(obj["data"]["asns"][0]["asn"])
+                    Info["Holder"] = obj["data"]["asns"][0]["holder"]
+                    Info["Prefix"] = obj["data"]["resource"]
+
                     self._Debug(
-                        "IXP found: prefix {}, name {}".format(
-                            IPPrefix,
-                            self.IXPsCache["Data"][IPPrefix]["name"]
+                        "Got data for {}: ASN {}, prefix {}".format(
+                            IP, Info["ASN"], Info["Prefix"]
                         )
                     )
-                    break
+                except:
+                    Info["ASN"] = "unknown"
+
+                    self._Debug("No data for %s" % IP)
+            else:
+                Info["ASN"] = "not announced"
+                Info["Holder"] = ""
+                Info["Prefix"] = obj["data"]["resource"]
+
+        if Info["Prefix"] != "":
+            IPPrefix = Info["Prefix"]
+
+            with self._lock:
+                old = self.IPPrefixesCache.get(IPPrefix)
+
+                entry = {
+                    "TS": Info["TS"],
+                    "ASN": Info["ASN"],
+                    "Holder": Info["Holder"]
+                }
+                if self.TTLPolicy:
+                    Info["TTL"] = self._apply_ttl_policy(IPPrefix, entry, old,
+                                                         previous)
+
+                self.IPPrefixesCache[IPPrefix] = entry
+                self._indexes.add_prefix(IPPrefix, entry, old)
+
+                if old is None:
+                    self._Debug("Adding %s to prefixes cache" % IPPrefix)
+                    self._index_prefix(IPPrefix)
+
+                if count_changes:
+                    self._count_changes(0, 1)
+
+        return Info
+
+    def _complete_address_info(self, AddrKey, key, Address, want_hostname,
+                               want_ixp, deadline):
+        # Fill the fields of a cached address that were not requested when
+        # it was added to the cache; return the updated record.
+        Result = Address._asdict(ttl=True)
+        changed = False
+
+        if want_hostname and Result["HostName"] is None:
+            # Aggregated IPv6 entries are shared by several addresses:
+            # their reverse DNS is not resolved.
+            if AddrKey is not key:
+                HostName = ""
+            else:
+                HostName = self._get_hostname(format_ip(key), deadline)
+            if HostName is not None:
+                Result["HostName"] = HostName
+                changed = True
+
+        if want_ixp and Result["IsIXP"] is None:
+            self._enrich_with_ixp_info(key, Result)
+            changed = changed or Result["IsIXP"] is not None
+
+        if not changed:
+            return Address
+
+        Address = IPInformation(**Result)
+        with self._lock:
+            old = self.IPAddressesCache.get(AddrKey)
+            self.IPAddressesCache[AddrKey] = Address
+            self._indexes.add_address(AddrKey, Address, old)
+            self._count_changes(1, 0)
+        return Address
+
+    def GetIPInformation(self, in_IP, fields=None, timeout=None, lane=None):
+        deadline = None if timeout is None else time.time() + timeout
+
+        if lane is not None and lane not in LANES:
+            raise ValueError("Unknown lane: {}".format(lane))
+
+        key = self.IPAddressNormaliser.normalise(in_IP)
+
+        if key in self.Bogons:
+            return UNKNOWN
+
+        if self._loading:
+            self._wait_for_prefixes()
+
+        # Key of the entry in the addresses cache: IPv6 addresses may be
+        # aggregated, or not cached at all (prefix only).
+        AddrKey = key
+        if key[0] == 6 and self._ipv6_mask is not None:
+            if self.IPv6PrefixOnly:
+                AddrKey = None
+            else:
+                AddrKey = (6, key[1] & self._ipv6_mask)
+
+        # Work for fields that are not requested is skipped: reverse DNS
+        # (HostName) and IXPs info (IsIXP, IXPName).
+        if fields is None:
+            want_hostname = want_ixp = True
+        else:
+            fields = self._get_fields(fields)
+            want_hostname = "HostName" in fields
+            want_ixp = "IsIXP" in fields or "IXPName" in fields
+
+        # Cache hits return the cached record itself: no copies.
+        Address = self.IPAddressesCache.get(AddrKey)
+        if Address is not None:
+            now = time.time()
+            TTL = Address.TTL
+            if TTL is None:
+                TTL = self.MAX_CACHE
+            if Address.TS >= now - TTL:
+                if TTL != self.MAX_CACHE and \
+                        Address.TS < now - self.MAX_CACHE:
+                    self._count_saved_fetch(Address.Prefix, Address.TS, now)
+                if self.Debug:
+                    self._Debug("IP address cache hit for %s" % in_IP)
+                if (want_hostname and Address.HostName is None) or \
+                        (want_ixp and self._needs_ixp_info(Address)):
+                    return self._complete_address_info(
+                        AddrKey, key, Address, want_hostname, want_ixp,
+                        deadline
+                    )
+                return Address
+            else:
+                self._Debug("Expired IP address cache hit for %s" % in_IP)
 
-    def GetIPInformation(self, in_IP):
         Result = {}
         Result["TS"] = 0
         Result["ASN"] = ""
         Result["Holder"] = ""
         Result["Prefix"] = ""
-        Result["HostName"] = ""
+        # Reverse DNS is not cached for aggregated IPv6 addresses: their
+        # HostName is always "".
+        aggregated = AddrKey is not None and AddrKey is not key
+        Result["HostName"] = "" if want_hostname or aggregated else None
         Result["IsIXP"] = None
         Result["IXPName"] = ""
+        Result["TTL"] = None
+
+        now = int(time.time())
+
+        # When neither HostName nor IXPs info are requested, results are
+        # given by the prefixes cache only: no address entries are added.
+        if not want_hostname and not want_ixp:
+            AddrKey = None
+
+        StalePrefix = None
+        for IPPrefix in self.IPPrefixesIndex.lookup_all(key):
+            Prefix = self.IPPrefixesCache.get(IPPrefix)
+            if Prefix is None:
+                continue
+            if Prefix["TS"] >= now - Prefix.get("TTL", self.MAX_CACHE):
+                Result["TS"] = Prefix["TS"]
+                Result["ASN"] = Prefix["ASN"]
+                Result["Holder"] = Prefix.get("Holder", "")
+                Result["Prefix"] = IPPrefix
+                Result["TTL"] = Prefix.get("TTL")
+                if Result["TTL"] is not None and \
+                        Prefix["TS"] < now - self.MAX_CACHE:
+                    self._count_saved_fetch(IPPrefix, Prefix["TS"], now)
+                self._Debug(
+                    "IP prefix cache hit for {} (prefix {})".format(
+                        in_IP, IPPrefix
+                    )
+                )
+                break
+            if StalePrefix is None:
+                StalePrefix = IPPrefix
 
-        IP = in_IP
-        IPObj = IPWrapper(IP)
-
-        if IP != IPObj.exploded():
-            IP = IPObj.exploded()
-
-        if IP not in self.IPAddressObjects:
-            self.IPAddressObjects[IP] = IPObj
+        PrefixAdded = False
+        if Result["ASN"] == "":
+            IP = format_ip(key)
 
-        if not IPObj.is_globally_routable():
-            Result["ASN"] = "unknown"
-            return Result
+            self._Debug("No cache hit for %s" % IP)
 
-        exp_epoch = int(time.time()) - self.MAX_CACHE
-        if IP in self.IPAddressesCache:
-            if self.IPAddressesCache[IP]["TS"] >= exp_epoch:
-                for k in self.IPAddressesCache[IP].keys():
-                    Result[k] = self.IPAddressesCache[IP][k]
-                self._Debug("IP address cache hit for %s" % IP)
-                self._enrich_with_ixp_info(IPObj, Result)
-                return Result
+            # What was known about the address, for the TTL policy
+            previous = None
+            if self.TTLPolicy:
+                if StalePrefix is not None and \
+                        StalePrefix in self.IPPrefixesCache:
+                    previous = dict(self.IPPrefixesCache[StalePrefix],
+                                    Prefix=StalePrefix)
+                elif Address is not None:
+                    previous = Address._asdict(ttl=True)
+
+            if deadline is None and not self.Scheduler:
+                Info = self._fetch_prefix_info(IP, False, previous)
+                PrefixAdded = Info["Prefix"] != ""
             else:
-                self._Debug("Expired IP address cache hit for %s" % IP)
-
-        for IPPrefix in self.IPPrefixesCache:
-            if self.IPPrefixesCache[IPPrefix]["TS"] >= exp_epoch:
-                if IPPrefix not in self.IPPrefixObjects:
-                    self.IPPrefixObjects[IPPrefix] = NetWrapper(IPPrefix)
-
-                if self.IPPrefixObjects[IPPrefix].contains(IPObj):
-                    Result["TS"] = self.IPPrefixesCache[IPPrefix]["TS"]
-                    Result["ASN"] = self.IPPrefixesCache[IPPrefix]["ASN"]
-                    Result["Holder"] = \
-                        self.IPPrefixesCache[IPPrefix].get("Holder", "")
-                    Result["Prefix"] = IPPrefix
-                    self._Debug(
-                        "IP prefix cache hit for {} (prefix {})".format(
-                            IP, IPPrefix
+                if self.Scheduler:
+                    call = self._schedule_fetch(IP, StalePrefix, previous,
+                                                lane)
+                else:
+                    call = self._call_in_background(("fetch", IP),
+                                                    self._fetch_prefix_info,
+                                                    IP, True, previous)
+                Info = self._wait_fetch(call, deadline)
+                if self.Scheduler and StalePrefix is not None and \
+                        Info is not None and Info["Prefix"] and \
+                        not self._prefix_contains(Info["Prefix"], key):
+                    # The fetch shared by the stale prefix was for another
+                    # address, and the prefix is not announced anymore as a
+                    # whole: this one is fetched on its own, in the same
+                    # lane.
+                    call = self._schedule_fetch(IP, None, previous, lane)
+                    Info = self._wait_fetch(call, deadline)
+                if Info is None:
+                    # The fetch goes on in background and its prefix will
+                    # be added to the cache; meanwhile, whatever is known.
+                    self._Debug("Timeout fetching info for %s" % IP)
+                    if Address is not None:
+                        return Address
+                    Prefix = self.IPPrefixesCache.get(StalePrefix)
+                    if Prefix is not None:
+                        return IPInformation(
+                            TS=Prefix["TS"], ASN=Prefix["ASN"],
+                            Holder=Prefix.get("Holder", ""),
+                            Prefix=StalePrefix, HostName=None
                         )
-                    )
-                    break
+                    return PENDING
+
+            Result.update(Info)
+
+            # Reverse DNS is not cached for aggregated IPv6 addresses.
+            # When HostName is not requested, or it's not resolved before
+            # the deadline, it's left to None, to be resolved by the first
+            # lookup that requests it.
+            if AddrKey is key and \
+                    (Result["ASN"].isdigit() or
+                     Result["ASN"] == "not announced"):
+                if want_hostname:
+                    Result["HostName"] = self._get_hostname(IP, deadline)
+                else:
+                    Result["HostName"] = None
 
-        if Result["ASN"] == "":
-            self._Debug("No cache hit for %s" % IP)
+        if want_ixp:
+            self._enrich_with_ixp_info(key, Result)
 
-            obj = self.FetchIPInfo(IP)
+        Record = IPInformation(**Result)
 
-            if obj["status"] == "ok":
-                Result["TS"] = int(time.time())
+        with self._lock:
+            if AddrKey is not None:
+                old = self.IPAddressesCache.get(AddrKey)
+                if old is None:
+                    self._Debug("Adding %s to addresses cache" % in_IP)
+                else:
+                    self._Debug("Updating addresses cache for %s" % in_IP)
 
-                if obj["data"]["asns"] != []:
-                    try:
-                        Result["ASN"] = str(obj["data"]["asns"][0]["asn"])
-                        Result["Holder"] = obj["data"]["asns"][0]["holder"]
-                        Result["Prefix"] = obj["data"]["resource"]
+                self.IPAddressesCache[AddrKey] = Record
+                self._indexes.add_address(AddrKey, Record, old)
 
-                        self._Debug(
-                            "Got data for {}: ASN {}, prefix {}".format(
-                                IP, Result["ASN"], Result["Prefix"]
-                            )
-                        )
-                    except:
-                        Result["ASN"] = "unknown"
+            self._count_changes(
+                1 if AddrKey is not None else 0,
+                1 if PrefixAdded else 0
+            )
 
-                        self._Debug("No data for %s" % IP)
-                else:
-                    Result["ASN"] = "not announced"
-                    Result["Holder"] = ""
-                    Result["Prefix"] = obj["data"]["resource"]
-
-            if Result["ASN"].isdigit() or Result["ASN"] == "not announced":
-                HostName = socket.getfqdn(IP)
-                if HostName == IP or HostName == "":
-                    Result["HostName"] = "unknown"
-                else:
-                    Result["HostName"] = HostName
+        return Record
+
+    def _save_json_file(self, path, data, descr):
+        self._Debug("Saving {} to {}.tmp".format(descr, path))
+        with open("%s.tmp" % path, "w") as outfile:
+            json.dump(data, outfile)
+
+        self._Debug("Renaming temporary {} file in {}".format(descr, path))
+        os.rename("%s.tmp" % path, path)
+
+    def IsCacheDirty(self):
+        """Return True if the cache has changes that have not been saved
+        yet."""
+        return self._addresses_changes > 0 or self._prefixes_changes > 0
+
+    def SaveCache(self, force=False):
+        # A cache that is still being loaded would be saved partially,
+        # and one that failed to load would overwrite the files.
+        self.WaitCacheReady()
+
+        with self._save_lock:
+            # Entries are replaced, never modified in place, so a shallow
+            # copy of the caches is a consistent snapshot: the lock is held
+            # only while taking it, not while writing the files.
+            with self._lock:
+                addresses_changes = self._addresses_changes
+                prefixes_changes = self._prefixes_changes
+
+                addresses = None
+                if self.IP_ADDRESSES_CACHE_FILE and \
+                        (force or addresses_changes):
+                    addresses = dict(self.IPAddressesCache)
+                    self._addresses_changes = 0
+
+                prefixes = None
+                if self.IP_PREFIXES_CACHE_FILE and \
+                        (force or prefixes_changes):
+                    prefixes = dict(self.IPPrefixesCache)
+                    self._prefixes_changes = 0
+
+            try:
+                # Save IP addresses cache
+                if addresses is not None:
+                    self._save_json_file(
+                        self.IP_ADDRESSES_CACHE_FILE,
+                        dict((format_ip(key), entry._asdict(ttl=True))
+                             for key, entry in addresses.items()),
+                        "IP addresses cache"
+                    )
+                    addresses_changes = 0
+
+                # Save IP prefixes cache
+                if prefixes is not None:
+                    self._save_json_file(
+                        self.IP_PREFIXES_CACHE_FILE,
+                        prefixes,
+                        "IP prefixes cache"
+                    )
+                    prefixes_changes = 0
+            finally:
+                # Changes that have not been saved are still pending.
+                with self._lock:
+                    if addresses is not None:
+                        self._addresses_changes += addresses_changes
+                    if prefixes is not None:
+                        self._prefixes_changes += prefixes_changes
+
+    def MergeCache(self, addresses, prefixes):
+        """Merge address and prefix entries into the cache.
+
+        ``addresses`` and ``prefixes`` are dicts in the same format of
+        IPAddressesCache and IPPrefixesCache (addresses may also be in
+        their textual form and their entries dicts); for entries already
+        in the cache, the one with the most recent TS wins. Merged entries
+        are saved with the next SaveCache."""
+        self._merge_entries(
+            self.IPAddressesCache,
+            ((self.IPAddressNormaliser.normalise(IP),
+              entry if isinstance(entry, IPInformation)
+              else IPInformation.from_dict(entry))
+             for IP, entry in addresses.items()),
+            False, changes=True
+        )
+        self._merge_entries(self.IPPrefixesCache, prefixes.items(), True,
+                            changes=True)
+
+    def ExportSnapshot(self, path, since=0, include_addresses=False):
+        """Write a snapshot of the cache to a gzip compressed file.
+
+        Only entries whose TS is not older than ``since`` are exported;
+        address entries are exported only if ``include_addresses`` is
+        True. The snapshot can be merged into other caches using
+        ImportSnapshot. Return the number of exported address and prefix
+        entries."""
+        with self._lock:
+            addresses = dict(self.IPAddressesCache) \
+                if include_addresses else {}
+            prefixes = dict(self.IPPrefixesCache)
+
+        snapshot = {
+            "Format": SNAPSHOT_FORMAT,
+            "Version": SNAPSHOT_VERSION,
+            "TS": int(time.time()),
+            "Addresses": dict(
+                (format_ip(key), entry._asdict(ttl=True))
+                for key, entry in addresses.items() if entry.TS >= since
+            ),
+            "Prefixes": dict(
+                (prefix, entry)
+                for prefix, entry in prefixes.items() if entry["TS"] >= since
+            )
+        }
 
-        self._enrich_with_ixp_info(IPObj, Result)
+        self._Debug("Exporting snapshot to %s" % path)
+        with gzip.open("%s.tmp" % path, "wb") as outfile:
+            outfile.write(json.dumps(snapshot,
+                                     separators=(",", ":")).encode("utf-8"))
+        os.rename("%s.tmp" % path, path)
 
-        if IP not in self.IPAddressesCache:
-            self.IPAddressesCache[IP] = {}
-            self._Debug("Adding %s to addresses cache" % IP)
-        else:
-            self._Debug("Updating addresses cache for %s" % IP)
+        return len(snapshot["Addresses"]), len(snapshot["Prefixes"])
 
-        self.IPAddressesCache[IP]["TS"] = Result["TS"]
-        self.IPAddressesCache[IP]["ASN"] = Result["ASN"]
-        self.IPAddressesCache[IP]["Holder"] = Result["Holder"]
-        self.IPAddressesCache[IP]["Prefix"] = Result["Prefix"]
-        self.IPAddressesCache[IP]["HostName"] = Result["HostName"]
-        self.IPAddressesCache[IP]["IsIXP"] = Result["IsIXP"]
-        self.IPAddressesCache[IP]["IXPName"] = Result["IXPName"]
+    def ImportSnapshot(self, path):
+        """Merge a snapshot written by ExportSnapshot into the cache.
 
-        if Result["Prefix"] != "":
-            IPPrefix = Result["Prefix"]
+        For entries already in the cache, the one with the most recent TS
+        wins. Return the number of address and prefix entries in the
+        snapshot."""
+        self._Debug("Importing snapshot from %s" % path)
+        try:
+            with gzip.open(path, "rb") as infile:
+                snapshot = json.loads(infile.read().decode("utf-8"))
+        except (IOError, OSError, ValueError) as e:
+            raise IPDetailsCacheError(
+                "Error reading snapshot {}: {}".format(path, str(e))
+            )
 
-            if IPPrefix not in self.IPPrefixesCache:
-                self.IPPrefixesCache[IPPrefix] = {}
-                self._Debug("Adding %s to prefixes cache" % IPPrefix)
+        if not isinstance(snapshot, dict) or \
+                snapshot.get("Format") != SNAPSHOT_FORMAT:
+            raise IPDetailsCacheError(
+                "Invalid snapshot {}: unknown format".format(path)
+            )
+        if snapshot.get("Version") != SNAPSHOT_VERSION:
+            raise IPDetailsCacheError(
+                "Invalid snapshot {}: unsupported version {}".format(
+                    path, snapshot.get("Version")
+                )
+            )
 
-            self.IPPrefixesCache[IPPrefix]["TS"] = Result["TS"]
-            self.IPPrefixesCache[IPPrefix]["ASN"] = Result["ASN"]
-            self.IPPrefixesCache[IPPrefix]["Holder"] = Result["Holder"]
+        addresses = snapshot.get("Addresses", {})
+        prefixes = snapshot.get("Prefixes", {})
+
+        self._merge_entries(self.IPAddressesCache,
+                            self._addresses_from_json(addresses.items()), False,
+                            changes=True)
+        self._merge_entries(self.IPPrefixesCache, prefixes.items(), True,
+                            changes=True)
+
+        return len(addresses), len(prefixes)
+
+    def _prefix_expired(self, entry, now):
+        return entry["TS"] < now - entry.get("TTL", self.MAX_CACHE)
+
+    def _address_expired(self, entry, now):
+        TTL = self.MAX_CACHE if entry.TTL is None else entry.TTL
+        return entry.TS < now - TTL
+
+    def GetPrefixesByASN(self, ASN, include_expired=False):
+        """Return the cached prefixes whose ASN is ``ASN``.
+
+        The result is a dict {prefix: entry}; expired entries are included
+        only if ``include_expired`` is True."""
+        ASN = str(ASN)
+        now = int(time.time())
+
+        with self._lock:
+            prefixes = list(self._indexes.asn_prefixes.get(ASN, ()))
+
+        res = {}
+        for IPPrefix in prefixes:
+            entry = self.IPPrefixesCache.get(IPPrefix)
+            if entry is None or entry["ASN"] != ASN:
+                continue
+            if include_expired or not self._prefix_expired(entry, now):
+                res[IPPrefix] = entry
+        return res
+
+    def GetAddressesInPrefix(self, IPPrefix, include_expired=False):
+        """Return the cached addresses whose Prefix is ``IPPrefix``.
+
+        The result is a dict {IP: IPInformation}; expired entries are
+        included only if ``include_expired`` is True."""
+        now = int(time.time())
+
+        with self._lock:
+            keys = list(self._indexes.prefix_addresses.get(IPPrefix, ()))
+
+        res = {}
+        for key in keys:
+            entry = self.IPAddressesCache.get(key)
+            if entry is None or entry.Prefix != IPPrefix:
+                continue
+            if include_expired or not self._address_expired(entry, now):
+                res[format_ip(key)] = entry
+        return res
+
+    def GetASNsByHolder(self, Holder):
+        """Return the set of ASNs of the cached prefixes whose holder is
+        ``Holder``."""
+        with self._lock:
+            return set(self._indexes.holder_asns.get(Holder, ()))
+
+    def PurgeExpired(self):
+        """Remove the expired entries from the cache.
+
+        Return the number of removed address and prefix entries; they are
+        removed from the cache files with the next SaveCache."""
+        now = int(time.time())
+
+        with self._lock:
+            addresses = [(key, entry)
+                         for key, entry in self.IPAddressesCache.items()
+                         if self._address_expired(entry, now)]
+            for key, entry in addresses:
+                del self.IPAddressesCache[key]
+                self._indexes.remove_address(key, entry)
+
+            prefixes = [(IPPrefix, entry)
+                        for IPPrefix, entry in self.IPPrefixesCache.items()
+                        if self._prefix_expired(entry, now)]
+            for IPPrefix, entry in prefixes:
+                del self.IPPrefixesCache[IPPrefix]
+                self._fold_saved_fetches(IPPrefix, entry)
+                self._indexes.remove_prefix(IPPrefix, entry)
+                try:
+                    self.IPPrefixesIndex.remove(IPPrefix)
+                except ValueError:
+                    pass
+
+            self._count_changes(len(addresses), len(prefixes))
+
+        self._Debug("Purged {} addresses and {} prefixes".format(
+            len(addresses), len(prefixes)))
+        return len(addresses), len(prefixes)
+
+    def _count_changes(self, addresses, prefixes):
+        # Must be called with self._lock held.
+        self._addresses_changes += addresses
+        self._prefixes_changes += prefixes
+
+        if self.AutosaveChanges and \
+                self._addresses_changes + self._prefixes_changes >= \
+                self.AutosaveChanges:
+            self._autosave_wakeup.set()
+
+    def _autosave(self, timeout_expired):
+        if not self.IsCacheDirty():
+            return
 
-        return Result
+        # Woken up before the interval expired: save only if enough
+        # changes have been made.
+        if not timeout_expired or not self.AutosaveInterval:
+            if not self.AutosaveChanges or \
+                    self._addresses_changes + self._prefixes_changes < \
+                    self.AutosaveChanges:
+                return
 
-    def SaveCache(self):
-        # Save IP addresses cache
+        self._Debug("Autosaving the cache")
+        self.SaveCache()
 
-        if self.IP_ADDRESSES_CACHE_FILE:
-            self._Debug(
-                "Saving IP addresses cache to {}.tmp".format(
-                    self.IP_ADDRESSES_CACHE_FILE
-                )
-            )
-            with open("%s.tmp" % self.IP_ADDRESSES_CACHE_FILE, "w") as outfile:
-                json.dump(self.IPAddressesCache, outfile)
+    def close(self):
+        """Stop the autosave thread and save the pending changes.
 
-            self._Debug(
-                "Renaming temporary IP addresses cache file in {}".format(
-                    self.IP_ADDRESSES_CACHE_FILE
-                )
-            )
-            os.rename("%s.tmp" % self.IP_ADDRESSES_CACHE_FILE,
-                      self.IP_ADDRESSES_CACHE_FILE)
+        The cache is not saved again on ``__del__``."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._autosave_wakeup:
+            self._autosave_wakeup.set()
+        self.SaveCache()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _load_json_file(self, path, descr):
+        if self._file_not_zero(path):
+            self._Debug("Loading {} from {}".format(descr, path))
+            with open(path) as json_data:
+                return json.load(json_data)
+        else:
+            self._Debug("No {} file found: {}".format(descr, path))
+            return None
+
+    def _iter_json_file(self, path, descr):
+        # Yield the items of the JSON object stored in path, parsing one
+        # item at a time: the C JSON parser holds the GIL until it's done,
+        # and parsing a large file at once would stall the lookups running
+        # in other threads.
+        if not self._file_not_zero(path):
+            self._Debug("No {} file found: {}".format(descr, path))
+            return
 
-        if self.IP_PREFIXES_CACHE_FILE:
-            # Save IP prefixes cache
-            self._Debug(
-                "Saving IP prefixes cache to {}.tmp".format(
-                    self.IP_PREFIXES_CACHE_FILE
+        self._Debug("Loading {} from {}".format(descr, path))
+        with open(path) as json_data:
+            text = json_data.read()
+
+        decode = json.JSONDecoder().raw_decode
+        skip = _JSON_WHITESPACE.match
+
+        idx = skip(text, 0).end()
+        if text[idx:idx + 1] != "{":
+            raise ValueError("Expecting object in {}".format(path))
+        idx = skip(text, idx + 1).end()
+        end = text[idx:idx + 1] == "}"
+        if end:
+            idx = skip(text, idx + 1).end()
+        while not end:
+            if text[idx:idx + 1] != '"':
+                raise ValueError(
+                    "Expecting key at char {} of {}".format(idx, path)
                 )
-            )
-            with open("%s.tmp" % self.IP_PREFIXES_CACHE_FILE, "w") as outfile:
-                json.dump(self.IPPrefixesCache, outfile)
-
-            self._Debug(
-                "Renaming temporary IP prefixes cache file in {}".format(
-                    self.IP_PREFIXES_CACHE_FILE
+            key, idx = decode(text, idx)
+            idx = skip(text, idx).end()
+            if text[idx:idx + 1] != ":":
+                raise ValueError(
+                    "Expecting ':' at char {} of {}".format(idx, path)
                 )
-            )
-            os.rename("%s.tmp" % self.IP_PREFIXES_CACHE_FILE,
-                      self.IP_PREFIXES_CACHE_FILE)
+            value, idx = decode(text, skip(text, idx + 1).end())
+            yield key, value
+
+            idx = skip(text, idx).end()
+            sep = text[idx:idx + 1]
+            if sep not in (",", "}"):
+                raise ValueError(
+                    "Expecting ',' or '}}' at char {} of {}".format(idx, path)
+                )
+            end = sep == "}"
+            idx = skip(text, idx + 1).end()
+        if idx != len(text):
+            raise ValueError("Extra data at char {} of {}".format(idx, path))
 
     def LoadCache(self):
         # Load IP addresses cache
 
         if self.IP_ADDRESSES_CACHE_FILE:
-            if self._file_not_zero(self.IP_ADDRESSES_CACHE_FILE):
-                self._Debug(
-                    "Loading IP addresses cache from {}".format(
-                        self.IP_ADDRESSES_CACHE_FILE
-                    )
-                )
-                json_data = open(self.IP_ADDRESSES_CACHE_FILE)
-                self.IPAddressesCache = json.load(json_data)
-                json_data.close()
-            else:
-                self._Debug(
-                    "No IP addresses cache file found: {}".format(
-                        self.IP_ADDRESSES_CACHE_FILE
-                    )
+            data = self._load_json_file(self.IP_ADDRESSES_CACHE_FILE,
+                                        "IP addresses cache")
+            if data is not None:
+                self.IPAddressesCache = dict(
+                    self._addresses_from_json(data.items())
                 )
 
         # Load IP prefixes cache
 
         if self.IP_PREFIXES_CACHE_FILE:
-            if self._file_not_zero(self.IP_PREFIXES_CACHE_FILE):
-                self._Debug(
-                    "Loading IP prefixes cache from {}".format(
-                        self.IP_PREFIXES_CACHE_FILE
-                    )
+            data = self._load_json_file(self.IP_PREFIXES_CACHE_FILE,
+                                        "IP prefixes cache")
+            if data is not None:
+                with self._lock:
+                    self.IPPrefixesCache = data
+                    self._rebuild_prefixes_index()
+
+        with self._lock:
+            self._indexes.rebuild(self.IPAddressesCache, self.IPPrefixesCache)
+
+    def _addresses_from_json(self, items):
+        # On disk, addresses are stored in their exploded textual form.
+        for IP, entry in items:
+            try:
+                key = parse_ip(IP)
+            except ValueError:
+                self._Debug("Invalid address in cache file: %s" % IP)
+                continue
+
+            if key[0] == 6 and self._ipv6_mask is not None:
+                # Entries saved with a different IPv6 aggregation
+                if self.IPv6PrefixOnly:
+                    continue
+                if key[1] & self._ipv6_mask != key[1]:
+                    key = (6, key[1] & self._ipv6_mask)
+                    entry = dict(entry, HostName="")
+            yield key, IPInformation.from_dict(entry)
+
+    def _merge_entries(self, cache, entries, is_prefix, changes=False):
+        # Entries are merged in chunks, so that lookups running in other
+        # threads are not stalled; entries already in the cache are kept
+        # if they are more recent. When changes is True, the merged
+        # entries are counted as changes to be saved.
+        merged = 0
+        entries = iter(entries)
+        while True:
+            chunk = list(itertools.islice(entries, self.LOAD_CHUNK_SIZE))
+            if not chunk:
+                break
+            with self._lock:
+                for key, entry in chunk:
+                    current = cache.get(key)
+                    if current is None:
+                        cache[key] = entry
+                        if is_prefix:
+                            self._index_prefix(key)
+                    elif current["TS"] < entry["TS"]:
+                        cache[key] = entry
+                    else:
+                        continue
+                    if is_prefix:
+                        self._fold_saved_fetches(key, current)
+                        self._indexes.add_prefix(key, entry, current)
+                    else:
+                        self._indexes.add_address(key, entry, current)
+                    merged += 1
+                if changes:
+                    self._count_changes(0 if is_prefix else merged,
+                                        merged if is_prefix else 0)
+                    merged = 0
+            time.sleep(0)
+
+    def _background_load(self):
+        try:
+            self._test_write_access()
+
+            # The prefixes cache is loaded first: until the addresses cache
+            # is ready, lookups can be answered by it.
+            # Files are parsed while their entries are merged, a chunk at a
+            # time.
+            if self.IP_PREFIXES_CACHE_FILE:
+                self._merge_entries(
+                    self.IPPrefixesCache,
+                    self._iter_json_file(self.IP_PREFIXES_CACHE_FILE,
+                                         "IP prefixes cache"),
+                    True
                 )
-
-                json_data = open(self.IP_PREFIXES_CACHE_FILE)
-                self.IPPrefixesCache = json.load(json_data)
-                json_data.close()
-            else:
-                self._Debug(
-                    "No IP prefixes cache file found: {}".format(
-                        self.IP_PREFIXES_CACHE_FILE
-                    )
+            self._prefixes_loaded.set()
+
+            if self.IP_ADDRESSES_CACHE_FILE:
+                self._merge_entries(
+                    self.IPAddressesCache,
+                    self._addresses_from_json(
+                        self._iter_json_file(self.IP_ADDRESSES_CACHE_FILE,
+                                             "IP addresses cache")
+                    ),
+                    False
                 )
+            self._Debug("Cache loaded")
+        except Exception as e:
+            self._load_error = e
+            self._Debug("Error while loading the cache: {}".format(str(e)))
+        finally:
+            self._loading = False
+            self._prefixes_loaded.set()
+            self._cache_loaded.set()
+
+    def _wait_for_prefixes(self):
+        # Lookups arriving while the cache is being loaded wait at most
+        # LazyLoadTimeout seconds for the prefixes cache; after that they
+        # go on with what has been loaded so far.
+        if self.LazyLoadTimeout != 0:
+            self._prefixes_loaded.wait(self.LazyLoadTimeout)
+
+    def IsCacheReady(self):
+        """Return True when the cache has been completely loaded; False
+        while it's being loaded or if the loading failed."""
+        return self._cache_loaded.is_set() and self._load_error is None
+
+    def WaitCacheReady(self, timeout=None):
+        """Wait for the cache to be completely loaded.
+
+        Return True if the cache is ready, False if the timeout expired.
+        Raise IPDetailsCacheError if the background loading failed."""
+        ready = self._cache_loaded.wait(timeout)
+        if self._load_error:
+            raise IPDetailsCacheError(
+                "Error loading the cache: {}".format(str(self._load_error))
+            )
+        return ready
 
     @staticmethod
     def _file_not_zero(path):
@@ -369,20 +1193,68 @@ class IPDetailsCache():
         else:
             return False
 
+    def _test_write_access(self):
+        if self.IP_ADDRESSES_CACHE_FILE:
+            # Test write access to IP addresses cache file
+            self._Debug("Testing write permissions on IP addresses cache file")
+            with open(self.IP_ADDRESSES_CACHE_FILE, "a") as outfile:
+                outfile.close()
+            self._Debug("Write permissions on IP addresses cache file OK")
+
+        if self.IP_PREFIXES_CACHE_FILE:
+            # Test write access to IP prefixes cache file
+            self._Debug("Testing write permissions on IP prefixes cache file")
+            with open(self.IP_PREFIXES_CACHE_FILE, "a") as outfile:
+                outfile.close()
+            self._Debug("Write permissions on IP prefixes cache file OK")
+
     def __init__(self, IP_ADDRESSES_CACHE_FILE="ip_addr.cache",
                  IP_PREFIXES_CACHE_FILE="ip_pref.cache", MAX_CACHE=604800,
-                 dont_save_on_del=False, Debug=False):
+                 dont_save_on_del=False, Debug=False, lazy_load=False,
+                 lazy_load_timeout=0, autosave_interval=None,
+                 autosave_changes=None, rate_limiter=None,
+                 ipv6_aggregation=128, ipv6_prefix_only=False, bogons=None,
+                 fetch_timeout=None, hedge_delay=None, transport=None,
+                 ttl_policy=None, scheduler=None):
 
         self.IPAddressesCache = {}
         self.IPPrefixesCache = {}
-        self.IPAddressObjects = {}
-        self.IPPrefixObjects = {}
+        self.IPPrefixesIndex = PrefixTable()
+        self.IPAddressNormaliser = AddressNormaliser()
+        self._indexes = CacheIndexes()
 
         self.IP_ADDRESSES_CACHE_FILE = IP_ADDRESSES_CACHE_FILE
         self.IP_PREFIXES_CACHE_FILE = IP_PREFIXES_CACHE_FILE
         self.MAX_CACHE = MAX_CACHE
 
+        # TTL policy (see the ttl module); None to use MAX_CACHE for all
+        # the entries.
+        self.TTLPolicy = ttl_policy
+        self._ttl_stats = {"Refreshes": 0, "Changes": 0, "SavedFetches": 0,
+                           "ExtraFetches": 0}
+        # prefix -> (TS, MAX_CACHE period, count) of the saved fetches
+        # counted for the current entry of the prefix (_count_saved_fetch)
+        self._saved_fetches = {}
+
+        if not 0 <= ipv6_aggregation <= 128:
+            raise ValueError("ipv6_aggregation must be between 0 and 128")
+        self.IPv6Aggregation = ipv6_aggregation
+        self.IPv6PrefixOnly = ipv6_prefix_only
+        self._ipv6_mask = None
+        if ipv6_prefix_only or ipv6_aggregation < 128:
+            self._ipv6_mask = netmask(6, ipv6_aggregation)
+
+        # Special-purpose address space, plus the user's bogons:
+        # lookups of these addresses are answered with ASN "unknown".
+        self.Bogons = SPECIAL_PURPOSE
+        if bogons:
+            self.Bogons = SPECIAL_PURPOSE.extend(bogons)
+
         self.IXPsCache = {}
+        self._ixps_index = None
+        self._ixps_index_data = None
+        self._ixps_refresh_thread = None
+        self._ixps_refresh_error = None
 
         # 0 = do not use, 1 = only when no ASN found, 2 = always
         self.UseIXPsCache = 0
@@ -390,21 +1262,67 @@ class IPDetailsCache():
         self.DontSaveOnDel = dont_save_on_del
         self.Debug = Debug
 
-        self.LoadCache()
-
-        if self.IP_ADDRESSES_CACHE_FILE:
-            # Test write access to IP addresses cache file
-            self._Debug("Testing write permissions on IP addresses cache file")
-            with open(self.IP_ADDRESSES_CACHE_FILE, "a") as outfile:
-                outfile.close()
-            self._Debug("Write permissions on IP addresses cache file OK")
-
-        if self.IP_PREFIXES_CACHE_FILE:
-            # Test write access to IP prefixes cache file
-            self._Debug("Testing write permissions on IP prefixes cache file")
-            with open(self.IP_PREFIXES_CACHE_FILE, "a") as outfile:
-                outfile.close()
-            self._Debug("Write permissions on IP prefixes cache file OK")
+        # RateLimiter used for RIPEStat requests
+        self.RateLimiter = rate_limiter
+
+        # Timeout of RIPEStat and PeeringDB requests, and delay after which
+        # a second RIPEStat request is sent if the first one is still
+        # pending (hedging).
+        self.FetchTimeout = fetch_timeout
+        self.HedgeDelay = hedge_delay
+
+        # Transport used for RIPEStat and PeeringDB requests (see the
+        # transport module); None to send them directly.
+        self.Transport = transport
+
+        # FetchScheduler that runs RIPEStat fetches in priority lanes (see
+        # the scheduler module); None to fetch them in the lookup's thread.
+        self.Scheduler = scheduler
+
+        # Calls (fetches, reverse DNS) running in background for lookups
+        # with a timeout: ("fetch"|"dns", IP) -> Call
+        self._inflight = {}
+
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+
+        # Number of changes not saved yet
+        self._addresses_changes = 0
+        self._prefixes_changes = 0
+
+        self._closed = False
+        self.AutosaveInterval = autosave_interval
+        self.AutosaveChanges = autosave_changes
+        self._autosave_wakeup = None
+        if autosave_interval or autosave_changes:
+            self._autosave_wakeup = threading.Event()
+            # The thread keeps a weak reference only, so that the cache can
+            # still be garbage collected.
+            saver = threading.Thread(target=_autosave_loop,
+                                     args=(weakref.ref(self),
+                                           self._autosave_wakeup,
+                                           autosave_interval),
+                                     name="IPDetailsCache autosave")
+            saver.daemon = True
+            saver.start()
+
+        self.LazyLoadTimeout = lazy_load_timeout
+        self._loading = False
+        self._load_error = None
+        self._prefixes_loaded = threading.Event()
+        self._cache_loaded = threading.Event()
+
+        if lazy_load:
+            self._loading = True
+            loader = threading.Thread(target=self._background_load,
+                                      name="IPDetailsCache loader")
+            loader.daemon = True
+            loader.start()
+        else:
+            self.LoadCache()
+            self._test_write_access()
+            self._prefixes_loaded.set()
+            self._cache_loaded.set()
 
     def LoadIXPsCache(self, cache_file):
         if not cache_file:
@@ -418,18 +1336,57 @@ class IPDetailsCache():
         else:
             self._Debug("No IXPs cache file found: %s" % cache_file)
 
-    def FetchIXPsInfo(self):
-        self._Debug("Fetching IXPs info from PeeringDB API...")
+    def _fetch_peeringdb_table(self, url, sync):
+        # Fetch the objects of a PeeringDB table that changed since the
+        # last sync; sync is updated in place. Return None if the table
+        # has not been modified.
+        headers = {}
+        if sync.get("since"):
+            url = "{}?since={}".format(url, sync["since"])
+            if sync.get("etag"):
+                headers["If-None-Match"] = sync["etag"]
+            if sync.get("last_modified"):
+                headers["If-Modified-Since"] = sync["last_modified"]
+
+        since = int(time.time())
+
+        status, resp_headers, body = self._open(url, headers)
+        if status == 304:
+            self._Debug("Not modified: %s" % url)
+            return None
+
+        # Header names are case-insensitive: transports may return them
+        # in any case.
+        resp_headers = dict((name.lower(), value)
+                            for name, value in (resp_headers or {}).items())
+
+        sync["since"] = since
+        sync["etag"] = resp_headers.get("etag")
+        sync["last_modified"] = resp_headers.get("last-modified")
+        return json.loads(body)
+
+    def FetchIXPsInfo(self, sync=None):
+        """Fetch IXPs info from PeeringDB API.
+
+        If sync is given, it's a dict with the state of the last sync of
+        each table ("ixpfx", "ixlan", "ix"); only the objects changed since
+        then are fetched, using conditional requests. It's updated in place.
+        Tables that have not been modified are returned as None."""
 
-        try:
-            url = IPDetailsCache.PEERINGDB_API_ixpfx
-            ixpfxs = json.loads(self._read_from_url(url))
+        self._Debug("Fetching IXPs info from PeeringDB API...")
 
-            url = IPDetailsCache.PEERINGDB_API_ixlan
-            ixlans = json.loads(self._read_from_url(url))
+        if sync is None:
+            sync = {}
 
-            url = IPDetailsCache.PEERINGDB_API_ix
-            ixs = json.loads(self._read_from_url(url))
+        try:
+            res = []
+            for table, url in [("ixpfx", IPDetailsCache.PEERINGDB_API_ixpfx),
+                               ("ixlan", IPDetailsCache.PEERINGDB_API_ixlan),
+                               ("ix", IPDetailsCache.PEERINGDB_API_ix)]:
+                res.append(
+                    self._fetch_peeringdb_table(url, sync.setdefault(table,
+                                                                     {}))
+                )
         except Exception as e:
             raise IPDetailsCacheIXPInformationError(
                 "Error fetching IXPs info from PeeringDB API: {}".format(
@@ -439,22 +1396,29 @@ class IPDetailsCache():
 
         self._Debug("IXPs info fetched")
 
-        return (ixpfxs, ixlans, ixs)
+        return tuple(res)
 
-    def ValidateIXPInfo(self, ixpfxs, ixlans, ixs):
+    def ValidateIXPInfo(self, ixpfxs, ixlans, ixs, incremental=False):
+        # When incremental is True, tables can be None (not modified) or
+        # have no changes at all.
 
         try:
             for dct, dct_name, keys in [
-                (ixpfxs, "ixpfxs", ["prefix", "ixlan_id"]),
+                (ixpfxs, "ixpfxs", ["prefix", "ixlan_id", "id"]),
                 (ixlans, "ixlans", ["id", "ix_id"]),
                 (ixs, "ixs", ["id", "name"])
             ]:
 
+                if incremental and dct is None:
+                    continue
+
                 if "data" not in dct:
                     raise KeyError(dct_name + " - missing key: data")
                 if not isinstance(dct["data"], list):
                     raise TypeError(dct_name + " - data is not a list")
                 if len(dct["data"]) == 0:
+                    if incremental:
+                        continue
                     raise ValueError(dct_name + " - data is empty")
 
                 dct_el = dct["data"][0]
@@ -474,8 +1438,102 @@ class IPDetailsCache():
                 )
             )
 
+    @staticmethod
+    def _apply_ixps_changes(objects, changes, key, fields):
+        if changes is None:
+            return
+        for obj in changes["data"]:
+            if obj.get("status") == "deleted":
+                objects.pop(str(obj[key]), None)
+            else:
+                objects[str(obj[key])] = dict((k, obj[k]) for k in fields)
+
+    def _sync_ixps(self, IXP_CACHE_FILE):
+        # IXPsCache["Objects"] keeps the PeeringDB objects needed to build
+        # IXPsCache["Data"], so that only the changes are fetched and
+        # applied on refresh; IXPsCache["Sync"] the state of the last sync.
+        old = self.IXPsCache
+        incremental = "Objects" in old and "Sync" in old
+
+        if incremental:
+            objects = dict((table, dict(old["Objects"][table]))
+                           for table in ["ixpfx", "ixlan", "ix"])
+            sync = json.loads(json.dumps(old["Sync"]))
+        else:
+            objects = {"ixpfx": {}, "ixlan": {}, "ix": {}}
+            sync = {}
+
+        ixpfxs, ixlans, ixs = self.FetchIXPsInfo(sync)
+
+        self.ValidateIXPInfo(ixpfxs, ixlans, ixs, incremental=incremental)
+
+        self._apply_ixps_changes(objects["ixpfx"], ixpfxs, "id",
+                                 ["prefix", "ixlan_id"])
+        self._apply_ixps_changes(objects["ixlan"], ixlans, "id", ["ix_id"])
+        self._apply_ixps_changes(objects["ix"], ixs, "id", ["name"])
+
+        if incremental and ixpfxs is None and ixlans is None and ixs is None:
+            self._Debug("IXPs info not modified")
+            ixpfx_dict = old["Data"]
+        else:
+            ixlans_dict = objects["ixlan"]
+            ixs_dict = objects["ix"]
+
+            ixpfx_dict = {}
+            for ixpfx in objects["ixpfx"].values():
+                ixlan = ixlans_dict.get(str(ixpfx["ixlan_id"]))
+                if ixlan is None:
+                    continue
+                ix = ixs_dict.get(str(ixlan["ix_id"]))
+                if ix is None:
+                    continue
+                ixpfx_dict[ixpfx["prefix"]] = {"name": ix["name"]}
+
+        IXPsCache = {
+            "TS": int(time.time()),
+            "Data": ixpfx_dict,
+            "Objects": objects,
+            "Sync": sync
+        }
+
+        if IXP_CACHE_FILE:
+            with open(IXP_CACHE_FILE, "w") as outfile:
+                json.dump(IXPsCache, outfile)
+
+        # The new table replaces the old one as a whole: lookups running
+        # in the meantime keep using the old one.
+        self.IXPsCache = IXPsCache
+
+    def _background_sync_ixps(self, IXP_CACHE_FILE):
+        try:
+            self._sync_ixps(IXP_CACHE_FILE)
+            self._get_ixps_index()
+            self._Debug("IXPs info refreshed")
+        except Exception as e:
+            self._ixps_refresh_error = e
+            self._Debug("Error refreshing IXPs info: {}".format(str(e)))
+
+    def WaitIXPsRefresh(self, timeout=None):
+        """Wait for a background refresh of IXPs info to complete.
+
+        Return True if no refresh is running anymore, False if the timeout
+        expired. Raise IPDetailsCacheIXPInformationError if the refresh
+        failed."""
+        thread = self._ixps_refresh_thread
+        if thread:
+            thread.join(timeout)
+            if thread.is_alive():
+                return False
+        error = self._ixps_refresh_error
+        if error:
+            self._ixps_refresh_error = None
+            if isinstance(error, IPDetailsCacheIXPInformationError):
+                raise error
+            raise IPDetailsCacheIXPInformationError(str(error))
+        return True
+
     def UseIXPs(self, WhenUse=1, IXP_CACHE_FILE="ixps.cache",
-                MAX_CACHE=604800):
+                MAX_CACHE=604800, background=False):
 
         self.UseIXPsCache = WhenUse
 
@@ -488,40 +1546,54 @@ class IPDetailsCache():
         self.LoadIXPsCache(IXP_CACHE_FILE)
 
         if "TS" in self.IXPsCache:
-            if self.IXPsCache["TS"] < int(time.time()) - self.MAX_CACHE:
+            if self.IXPsCache["TS"] < int(time.time()) - MAX_CACHE:
                 self._Debug("IXPs cache expired. Updating it...")
             else:
                 return
 
-        ixpfxs, ixlans, ixs = self.FetchIXPsInfo()
-
-        self.ValidateIXPInfo(ixpfxs, ixlans, ixs)
-
-        ixs_dict = {}
-        for ix in ixs["data"]:
-            ixs_dict[str(ix["id"])] = {"name": ix["name"]}
-
-        ixlans_dict = {}
-        for ixlan in ixlans["data"]:
-            ixlans_dict[str(ixlan["id"])] = {"ix_id": ixlan["ix_id"]}
+        if not background:
+            self._sync_ixps(IXP_CACHE_FILE)
+            return
 
-        ixpfx_dict = {}
-        for ixpfx in ixpfxs["data"]:
-            prefix = ixpfx["prefix"]
-            ixlan_id = ixpfx["ixlan_id"]
-            ix_id = ixlans_dict[str(ixlan_id)]["ix_id"]
-            ixpfx_dict[prefix] = {
-                "name": ixs_dict[str(ix_id)]["name"]
-            }
-            self.IXPsCache = {
-                "TS": int(time.time()),
-                "Data": ixpfx_dict
-            }
+        if self._ixps_refresh_thread and self._ixps_refresh_thread.is_alive():
+            self._Debug("IXPs info refresh already running")
+            return
 
-        if IXP_CACHE_FILE:
-            with open(IXP_CACHE_FILE, "w") as outfile:
-                json.dump(self.IXPsCache, outfile)
+        self._ixps_refresh_error = None
+        self._ixps_refresh_thread = threading.Thread(
+            target=self._background_sync_ixps,
+            args=(IXP_CACHE_FILE,),
+            name="IPDetailsCache IXPs refresh"
+        )
+        self._ixps_refresh_thread.daemon = True
+        self._ixps_refresh_thread.start()
 
     def __del__(self):
+        # _closed is not set if __init__ failed
+        if getattr(self, "_closed", True):
+            return
+        if self._autosave_wakeup:
+            self._closed = True
+            self._autosave_wakeup.set()
         if not self.DontSaveOnDel:
             self.SaveCache()
+
+
+def _autosave_loop(cache_ref, wakeup, interval):
+    # Used by IPDetailsCache autosave thread.
+    while True:
+        # Without an interval, wake up from time to time anyway to check
+        # whether the cache is still alive.
+        timeout_expired = not wakeup.wait(interval or 60)
+        wakeup.clear()
+
+        cache = cache_ref()
+        if cache is None or cache._closed:
+            return
+        try:
+            cache._autosave(timeout_expired)
+        except Exception as e:
+            cache._Debug("Error while autosaving the cache: {}".format(
+                str(e)
+            ))
+        del cache
@@ -0,0 +1,232 @@
+# Copyright (c) 2016 Pier Carlo Chiodi - http://www.pierky.com
+# Licensed under The MIT License (MIT) - http://opensource.org/licenses/MIT
+
+"""IP addresses and prefixes normalisation.
+
+Addresses are turned into ``(version, value)`` keys, where ``value`` is the
+integer representation of the address; prefixes are turned into
+``(version, network, length)`` tuples. Cache keys and prefix containment
+tests work on these integer forms only, using the standard library's
+``socket.inet_pton`` for parsing."""
+
+import socket
+import struct
+from bisect import bisect_right
+
+_V4 = struct.Struct("!I")
+_V6 = struct.Struct("!QQ")
+
+MAX_PREFIX_LEN = {4: 32, 6: 128}
+
+
+def parse_ip(ip):
+    """Return the ``(version, value)`` key of a textual IP address.
+
+    Raise ValueError if ``ip`` is not a valid IPv4 or IPv6 address."""
+    try:
+        return 4, _V4.unpack(socket.inet_pton(socket.AF_INET, ip))[0]
+    except (socket.error, TypeError):
+        pass
+    try:
+        hi, lo = _V6.unpack(socket.inet_pton(socket.AF_INET6, ip))
+    except (socket.error, TypeError):
+        raise ValueError("Invalid IP address: {}".format(ip))
+    return 6, (hi << 64) | lo
+
+
+def format_ip(key):
+    """Return the exploded textual form of a ``(version, value)`` key."""
+    version, value = key
+    if version == 4:
+        return socket.inet_ntop(socket.AF_INET, _V4.pack(value))
+    s = "%032x" % value
+    return ":".join(s[i:i + 4] for i in range(0, 32, 4))
+
+
+def netmask(version, length):
+    max_len = MAX_PREFIX_LEN[version]
+    return ((1 << max_len) - 1) ^ ((1 << (max_len - length)) - 1)
+
+
+def parse_prefix(prefix):
+    """Return the ``(version, network, length)`` tuple of a textual prefix.
+
+    A prefix without the length part is considered a host prefix (/32 or
+    /128). Host bits are cleared. Raise ValueError on invalid input."""
+    if "/" in prefix:
+        ip, length = prefix.split("/", 1)
+        version, value = parse_ip(ip)
+        try:
+            length = int(length)
+        except ValueError:
+            raise ValueError("Invalid prefix length: {}".format(prefix))
+        if not 0 <= length <= MAX_PREFIX_LEN[version]:
+            raise ValueError("Invalid prefix length: {}".format(prefix))
+    else:
+        version, value = parse_ip(prefix)
+        length = MAX_PREFIX_LEN[version]
+    return version, value & netmask(version, length), length
+
+
+class AddressNormaliser(object):
+    """Turn raw addresses into ``(version, value)`` keys.
+
+    Recently seen raw strings are memoised, so that the same input is parsed
+    only once; keys that are already normalised are returned as they are.
+    The memo is flushed when it reaches ``size`` entries."""
+
+    def __init__(self, size=65536):
+        self.size = size
+        self._memo = {}
+
+    def normalise(self, ip):
+        if ip.__class__ is tuple:
+            return ip
+        try:
+            return self._memo[ip]
+        except KeyError:
+            pass
+        key = parse_ip(ip)
+        if len(self._memo) >= self.size:
+            self._memo.clear()
+        self._memo[ip] = key
+        return key
+
+
+class PrefixTable(object):
+    """Longest-match table of prefixes.
+
+    Prefixes are grouped by version and length; each group maps the integer
+    network to the value stored for the prefix, so a lookup costs one dict
+    probe per distinct prefix length.
+
+    Lookups take no lock: the list of groups is never modified in place but
+    replaced by an updated copy. Writers must be serialised by the
+    caller."""
+
+    def __init__(self):
+        # version -> list of (length, mask, {network: value}),
+        # longest prefix first
+        self._groups = {4: [], 6: []}
+
+    def __len__(self):
+        return sum(len(nets) for groups in self._groups.values()
+                   for _, _, nets in groups)
+
+    def _group(self, version, length, create=False):
+        groups = self._groups[version]
+        for group in groups:
+            if group[0] == length:
+                return group[2]
+        if not create:
+            return None
+        nets = {}
+        groups = groups + [(length, netmask(version, length), nets)]
+        groups.sort(key=lambda group: group[0], reverse=True)
+        self._groups[version] = groups
+        return nets
+
+    def add(self, prefix, value):
+        version, network, length = parse_prefix(prefix)
+        self._group(version, length, create=True)[network] = value
+
+    def remove(self, prefix):
+        version, network, length = parse_prefix(prefix)
+        nets = self._group(version, length)
+        if nets is not None:
+            nets.pop(network, None)
+
+    def lookup_all(self, key):
+        """Yield the values of all the prefixes containing ``key``, longest
+        prefix first."""
+        version, value = key
+        for _, mask, nets in self._groups[version]:
+            found = nets.get(value & mask)
+            if found is not None:
+                yield found
+
+    def lookup(self, key):
+        """Return the value of the longest prefix containing ``key``, or
+        None."""
+        version, value = key
+        for _, mask, nets in self._groups[version]:
+            found = nets.get(value & mask)
+            if found is not None:
+                return found
+        return None
+
+
+class RangeTable(object):
+    """Set of address ranges.
+
+    Prefixes are compiled into sorted lists of non-overlapping integer
+    ranges, one for each version, so a membership test costs a single
+    bisect. Tables are immutable: ``extend`` returns a new one."""
+
+    def __init__(self, prefixes=()):
+        self.prefixes = tuple(prefixes)
+
+        ranges = {4: [], 6: []}
+        for prefix in self.prefixes:
+            version, network, length = parse_prefix(prefix)
+            hostmask = (1 << (MAX_PREFIX_LEN[version] - length)) - 1
+            ranges[version].append((network, network | hostmask))
+
+        self._starts = {}
+        self._ends = {}
+        for version in ranges:
+            merged = []
+            for start, end in sorted(ranges[version]):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self._starts[version] = [start for start, _ in merged]
+            self._ends[version] = [end for _, end in merged]
+
+    def __len__(self):
+        return len(self._starts[4]) + len(self._starts[6])
+
+    def __contains__(self, key):
+        version, value = key
+        i = bisect_right(self._starts[version], value)
+        return i > 0 and value <= self._ends[version][i - 1]
+
+    def extend(self, prefixes):
+        return RangeTable(self.prefixes + tuple(prefixes))
+
+
+# Address space that is not globally reachable, from the IANA IPv4 and IPv6
+# Special-Purpose Address Registries, plus multicast, the reserved 240/4 and
+# the IPv6 space outside of the global unicast 2000::/3.
+SPECIAL_PURPOSE_PREFIXES = (
+    "0.0.0.0/8",            # "This network"
+    "10.0.0.0/8",           # Private-Use
+    "100.64.0.0/10",        # Shared Address Space
+    "127.0.0.0/8",          # Loopback
+    "169.254.0.0/16",       # Link Local
+    "172.16.0.0/12",        # Private-Use
+    "192.0.0.0/24",         # IETF Protocol Assignments
+    "192.0.2.0/24",         # Documentation (TEST-NET-1)
+    "192.88.99.0/24",       # 6to4 Relay Anycast (deprecated)
+    "192.168.0.0/16",       # Private-Use
+    "198.18.0.0/15",        # Benchmarking
+    "198.51.100.0/24",      # Documentation (TEST-NET-2)
+    "203.0.113.0/24",       # Documentation (TEST-NET-3)
+    "224.0.0.0/4",          # Multicast
+    "240.0.0.0/4",          # Reserved, Limited Broadcast
+
+    "::/3",                 # Unspecified, Loopback, IPv4-mapped, NAT64...
+    "4000::/2",             # ULA, Link-Local, Multicast...
+    "8000::/1",
+    "2001:2::/48",          # Benchmarking
+    "2001:10::/28",         # ORCHID (deprecated)
+    "2001:db8::/32",        # Documentation
+    "3fff::/20",            # Documentation
+)
+
+SPECIAL_PURPOSE = RangeTable(SPECIAL_PURPOSE_PREFIXES)
+
+
+def is_globally_routable(key, bogons=SPECIAL_PURPOSE):
+    return key not in bogons
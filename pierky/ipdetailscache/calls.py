@@ -0,0 +1,80 @@
+# Copyright (c) 2016 Pier Carlo Chiodi - http://www.pierky.com
+# Licensed under The MIT License (MIT) - http://opensource.org/licenses/MIT
+
+"""Calls running in background threads.
+
+They are used to put a deadline on lookups (the caller stops waiting but
+the call goes on) and to hedge requests (more attempts of the same call
+race, the first one to succeed wins)."""
+
+import threading
+
+
+class Call(object):
+    """Result of a function running in one or more background threads.
+
+    Each ``start`` runs a new attempt of ``func(*args)``: the first attempt
+    that succeeds sets the result and the others are discarded; the call
+    fails only if all the attempts fail. ``on_done`` is called once the
+    call is complete, before waiters are woken up."""
+
+    def __init__(self, func, args=(), name=None, on_done=None):
+        self._func = func
+        self._args = args
+        self._name = name
+        self._on_done = on_done
+
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._finished = False
+        self._running = 0
+        self._result = None
+        self._error = None
+
+    def start(self):
+        """Start a new attempt; return False if the call is already
+        complete."""
+        with self._lock:
+            if self._finished:
+                return False
+            self._running += 1
+
+        thread = threading.Thread(target=self._run, name=self._name)
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def _run(self):
+        try:
+            result = self._func(*self._args)
+        except Exception as e:
+            with self._lock:
+                self._running -= 1
+                if self._finished or self._running > 0:
+                    return
+                self._finished = True
+                self._error = e
+        else:
+            with self._lock:
+                self._running -= 1
+                if self._finished:
+                    return
+                self._finished = True
+                self._result = result
+
+        try:
+            if self._on_done:
+                self._on_done()
+        finally:
+            self._done.set()
+
+    def wait(self, timeout=None):
+        """Wait for the call to complete; return False if the timeout
+        expired."""
+        return self._done.wait(timeout)
+
+    def result(self):
+        """Return the result of a complete call, or raise its error."""
+        if self._error is not None:
+            raise self._error
+        return self._result
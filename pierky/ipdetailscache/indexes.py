@@ -0,0 +1,89 @@
+# Copyright (c) 2016 Pier Carlo Chiodi - http://www.pierky.com
+# Licensed under The MIT License (MIT) - http://opensource.org/licenses/MIT
+
+"""Secondary indexes of the cache entries.
+
+They are updated every time an entry is added, replaced or removed, so that
+aggregate queries (prefixes of an ASN, addresses of a prefix, ASNs of a
+holder) cost time proportional to the size of their result, not to the
+size of the cache."""
+
+
+def _add(index, key, value):
+    values = index.get(key)
+    if values is None:
+        index[key] = set([value])
+    else:
+        values.add(value)
+
+
+def _discard(index, key, value):
+    values = index.get(key)
+    if values is not None:
+        values.discard(value)
+        if not values:
+            del index[key]
+
+
+class CacheIndexes(object):
+    """ASN -> prefixes, prefix -> addresses and holder -> ASNs indexes.
+
+    ``old`` is the entry being replaced, if any. Writers must be
+    serialised by the caller."""
+
+    def __init__(self):
+        # ASN -> set of prefixes
+        self.asn_prefixes = {}
+        # prefix -> set of (version, value) address keys
+        self.prefix_addresses = {}
+        # holder -> {ASN: number of prefixes}
+        self.holder_asns = {}
+
+    def clear(self):
+        self.asn_prefixes.clear()
+        self.prefix_addresses.clear()
+        self.holder_asns.clear()
+
+    def _add_holder(self, holder, ASN):
+        if not holder:
+            return
+        asns = self.holder_asns.setdefault(holder, {})
+        asns[ASN] = asns.get(ASN, 0) + 1
+
+    def _remove_holder(self, holder, ASN):
+        asns = self.holder_asns.get(holder)
+        if not asns or ASN not in asns:
+            return
+        asns[ASN] -= 1
+        if asns[ASN] <= 0:
+            del asns[ASN]
+            if not asns:
+                del self.holder_asns[holder]
+
+    def add_prefix(self, prefix, entry, old=None):
+        if old is not None:
+            self.remove_prefix(prefix, old)
+        _add(self.asn_prefixes, entry["ASN"], prefix)
+        self._add_holder(entry.get("Holder", ""), entry["ASN"])
+
+    def remove_prefix(self, prefix, entry):
+        _discard(self.asn_prefixes, entry["ASN"], prefix)
+        self._remove_holder(entry.get("Holder", ""), entry["ASN"])
+
+    def add_address(self, key, entry, old=None):
+        if old is not None:
+            if old.Prefix == entry.Prefix:
+                return
+            self.remove_address(key, old)
+        if entry.Prefix:
+            _add(self.prefix_addresses, entry.Prefix, key)
+
+    def remove_address(self, key, entry):
+        _discard(self.prefix_addresses, entry.Prefix, key)
+
+    def rebuild(self, addresses, prefixes):
+        self.clear()
+        for prefix, entry in prefixes.items():
+            self.add_prefix(prefix, entry)
+        for key, entry in addresses.items():
+            self.add_address(key, entry)
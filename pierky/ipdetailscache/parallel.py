@@ -0,0 +1,225 @@
+# Copyright (c) 2016 Pier Carlo Chiodi - http://www.pierky.com
+# Licensed under The MIT License (MIT) - http://opensource.org/licenses/MIT
+
+"""Parallel enrichment of large sets of IP addresses.
+
+Addresses are split among a pool of worker processes, each one using its
+own IPDetailsCache. Sharding is done on address prefixes (/16 for IPv4 and
+/32 for IPv6 by default): addresses of the same network are always handled
+by the same worker, so that its cache stays hot and each prefix is fetched
+from RIPEStat by one worker only (unless the prefix is shorter than the
+sharding length)."""
+
+import multiprocessing
+import threading
+import traceback
+
+from . import IPDetailsCacheError
+from .addresses import MAX_PREFIX_LEN, parse_prefix
+
+
+def _worker(cache_class, cache_kwargs, addresses, prefixes, ixps, fields,
+            in_queue, out_queue):
+    try:
+        cache = cache_class(IP_ADDRESSES_CACHE_FILE=None,
+                            IP_PREFIXES_CACHE_FILE=None,
+                            dont_save_on_del=True, **cache_kwargs)
+        cache.IPAddressesCache.update(addresses)
+        cache.IPPrefixesCache.update(prefixes)
+        cache._rebuild_prefixes_index()
+        cache.UseIXPsCache, cache.IXPsCache = ixps
+
+        while True:
+            batch = in_queue.get()
+            if batch is None:
+                break
+            out_queue.put(("results",
+                           [(idx, IP, cache.GetIPInformation(IP, fields))
+                            for idx, IP in batch]))
+
+        # Only new or updated entries are sent back to the main process.
+        new_addresses = dict(
+            (key, entry) for key, entry in cache.IPAddressesCache.items()
+            if addresses.get(key) is not entry
+        )
+        new_prefixes = dict(
+            (prefix, entry) for prefix, entry in cache.IPPrefixesCache.items()
+            if prefixes.get(prefix) is not entry
+        )
+        out_queue.put(("done", new_addresses, new_prefixes))
+    except Exception:
+        out_queue.put(("error", traceback.format_exc()))
+
+
+class ParallelEnricher(object):
+    """Enrich IP addresses using a pool of worker processes.
+
+    - ``cache``, the IPDetailsCache whose entries are used to seed the
+      workers' caches and where their new entries are merged (and saved) at
+      the end;
+    - ``workers``, number of worker processes (default: number of CPUs);
+    - ``ordered``, yield results in input order; when False, they are yielded
+      as soon as they are available;
+    - ``rate_limiter``, a ``RateLimiter`` created with ``shared=True``, used
+      as the global budget for RIPEStat requests of all the workers;
+    - ``shard_len_v4`` and ``shard_len_v6``, length of the prefixes used to
+      shard addresses among workers;
+    - ``batch_size``, number of addresses sent to workers at once; partial
+      batches are sent every ``batch_size * workers`` addresses, so that
+      results keep flowing when shards are unbalanced;
+    - ``fields``, passed to ``GetIPInformation``.
+
+    Workers' caches are instances of the same class of ``cache``."""
+
+    # Max number of batches waiting to be processed by each worker
+    QUEUE_SIZE = 8
+
+    def __init__(self, cache, workers=None, ordered=True, rate_limiter=None,
+                 shard_len_v4=16, shard_len_v6=32, batch_size=256,
+                 fields=None):
+        self.cache = cache
+        self.workers = workers or multiprocessing.cpu_count()
+        self.ordered = ordered
+        self.rate_limiter = rate_limiter
+        self.shard_len = {4: shard_len_v4, 6: shard_len_v6}
+        self.batch_size = batch_size
+        self.fields = fields
+
+    def _shard(self, key):
+        version, value = key
+        return (value >> (MAX_PREFIX_LEN[version] - self.shard_len[version])) \
+            % self.workers
+
+    def _seeds(self):
+        addresses = [{} for _ in range(self.workers)]
+        prefixes = [{} for _ in range(self.workers)]
+
+        with self.cache._lock:
+            address_items = list(self.cache.IPAddressesCache.items())
+            prefix_items = list(self.cache.IPPrefixesCache.items())
+
+        for key, entry in address_items:
+            addresses[self._shard(key)][key] = entry
+
+        for prefix, entry in prefix_items:
+            try:
+                version, network, length = parse_prefix(prefix)
+            except ValueError:
+                continue
+            if length >= self.shard_len[version]:
+                prefixes[self._shard((version, network))][prefix] = entry
+            else:
+                # It spans more shards: all the workers need it.
+                for worker_prefixes in prefixes:
+                    worker_prefixes[prefix] = entry
+
+        return addresses, prefixes
+
+    def _feed(self, IPs, in_queues, state):
+        # Partial batches are sent every flush_every addresses: otherwise
+        # a rare shard would hold back the addresses before it, and in
+        # ordered mode all the results that follow them would be kept in
+        # memory until the end of the input.
+        batches = [[] for _ in range(self.workers)]
+        flush_every = self.batch_size * self.workers
+        try:
+            normalise = self.cache.IPAddressNormaliser.normalise
+            for idx, IP in enumerate(IPs):
+                worker = self._shard(normalise(IP))
+                batches[worker].append((idx, IP))
+                if len(batches[worker]) >= self.batch_size:
+                    in_queues[worker].put(batches[worker])
+                    batches[worker] = []
+                if (idx + 1) % flush_every == 0:
+                    for worker, batch in enumerate(batches):
+                        if batch:
+                            in_queues[worker].put(batch)
+                            batches[worker] = []
+        except Exception as e:
+            state["error"] = e
+        finally:
+            for worker in range(self.workers):
+                if batches[worker]:
+                    in_queues[worker].put(batches[worker])
+                in_queues[worker].put(None)
+
+    def Enrich(self, IPs):
+        """Yield ``(IP, result)`` tuples for the addresses in ``IPs``.
+
+        Once all the addresses have been processed, the entries gathered by
+        the workers are merged into the main cache, which is then saved."""
+        cache_kwargs = {
+            "MAX_CACHE": self.cache.MAX_CACHE,
+            "rate_limiter": self.rate_limiter,
+            "ipv6_aggregation": self.cache.IPv6Aggregation,
+            "ipv6_prefix_only": self.cache.IPv6PrefixOnly,
+            "bogons": self.cache.Bogons.prefixes,
+            "fetch_timeout": self.cache.FetchTimeout,
+            "hedge_delay": self.cache.HedgeDelay,
+            "ttl_policy": self.cache.TTLPolicy
+        }
+        ixps = (self.cache.UseIXPsCache, self.cache.IXPsCache)
+        addresses, prefixes = self._seeds()
+
+        in_queues = [multiprocessing.Queue(self.QUEUE_SIZE)
+                     for _ in range(self.workers)]
+        out_queue = multiprocessing.Queue()
+
+        processes = []
+        for worker in range(self.workers):
+            process = multiprocessing.Process(
+                target=_worker,
+                args=(self.cache.__class__, cache_kwargs, addresses[worker],
+                      prefixes[worker], ixps, self.fields, in_queues[worker],
+                      out_queue),
+                name="IPDetailsCache worker {}".format(worker)
+            )
+            process.daemon = True
+            process.start()
+            processes.append(process)
+        del addresses, prefixes
+
+        state = {"error": None}
+        feeder = threading.Thread(target=self._feed,
+                                  args=(IPs, in_queues, state),
+                                  name="IPDetailsCache feeder")
+        feeder.daemon = True
+        feeder.start()
+
+        try:
+            pending = {}
+            next_idx = 0
+            done = 0
+            while done < self.workers:
+                msg = out_queue.get()
+
+                if msg[0] == "results":
+                    if not self.ordered:
+                        for idx, IP, result in msg[1]:
+                            yield IP, result
+                        continue
+                    for idx, IP, result in msg[1]:
+                        pending[idx] = (IP, result)
+                    while next_idx in pending:
+                        yield pending.pop(next_idx)
+                        next_idx += 1
+
+                elif msg[0] == "done":
+                    self.cache.MergeCache(msg[1], msg[2])
+                    done += 1
+
+                else:
+                    raise IPDetailsCacheError(
+                        "Error in worker process: {}".format(msg[1])
+                    )
+
+            feeder.join()
+            if state["error"]:
+                raise state["error"]
+
+            self.cache.SaveCache()
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
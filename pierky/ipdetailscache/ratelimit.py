@@ -0,0 +1,53 @@
+# Copyright (c) 2016 Pier Carlo Chiodi - http://www.pierky.com
+# Licensed under The MIT License (MIT) - http://opensource.org/licenses/MIT
+
+"""Rate limiting of the requests sent to the RIPEStat API."""
+
+import multiprocessing
+import threading
+import time
+
+
+class _Value(object):
+    __slots__ = ["value"]
+
+    def __init__(self, value):
+        self.value = value
+
+
+class RateLimiter(object):
+    """Limit requests to ``rate`` per second, allowing bursts of ``burst``
+    requests.
+
+    With ``shared=True`` the budget is kept in shared memory and enforced
+    globally among the processes the limiter is passed to when they are
+    created (multiprocessing)."""
+
+    def __init__(self, rate, burst=1, shared=False):
+        if rate <= 0:
+            raise ValueError("rate must be greater than 0")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+
+        self.rate = rate
+        self.burst = burst
+        self._interval = 1.0 / rate
+        self._burst_time = self._interval * (burst - 1)
+
+        # Theoretical arrival time of the next request (GCRA)
+        if shared:
+            self._tat = multiprocessing.Value("d", 0.0, lock=False)
+            self._lock = multiprocessing.Lock()
+        else:
+            self._tat = _Value(0.0)
+            self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a request can be sent."""
+        with self._lock:
+            now = time.time()
+            tat = max(self._tat.value, now)
+            self._tat.value = tat + self._interval
+        delay = tat - self._burst_time - now
+        if delay > 0:
+            time.sleep(delay)
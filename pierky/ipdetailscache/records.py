@@ -0,0 +1,83 @@
+# Copyright (c) 2016 Pier Carlo Chiodi - http://www.pierky.com
+# Licensed under The MIT License (MIT) - http://opensource.org/licenses/MIT
+
+"""Results of IP address lookups."""
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+FIELDS = ("TS", "ASN", "Holder", "Prefix", "HostName", "IsIXP", "IXPName")
+_FIELDS = frozenset(FIELDS)
+_ARGS = frozenset(FIELDS + ("TTL",))
+
+
+class IPInformation(Mapping):
+    """Immutable details of an IP address.
+
+    Fields are available as attributes and, for backward compatibility with
+    the dictionaries returned by previous versions, as mapping keys. The
+    same object is stored in the addresses cache and returned by every
+    lookup that hits it, so it can't be modified: use ``_replace`` to get
+    an updated copy or ``_asdict`` to get a dict.
+
+    ``TTL``, the time to live set by the cache's TTL policy (None when the
+    cache's MAX_CACHE applies), is an attribute but not a mapping key."""
+
+    __slots__ = FIELDS + ("TTL",)
+
+    def __init__(self, TS=0, ASN="", Holder="", Prefix="", HostName="",
+                 IsIXP=None, IXPName="", TTL=None):
+        set_field = object.__setattr__
+        set_field(self, "TS", TS)
+        set_field(self, "ASN", ASN)
+        set_field(self, "Holder", Holder)
+        set_field(self, "Prefix", Prefix)
+        set_field(self, "HostName", HostName)
+        set_field(self, "IsIXP", IsIXP)
+        set_field(self, "IXPName", IXPName)
+        set_field(self, "TTL", TTL)
+
+    @classmethod
+    def from_dict(cls, dct):
+        """Build an IPInformation from a dict, ignoring unknown keys."""
+        return cls(**dict((k, v) for k, v in dct.items() if k in _ARGS))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("IPInformation objects are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("IPInformation objects are immutable")
+
+    def __getitem__(self, key):
+        if key in _FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __reduce__(self):
+        return (self.__class__,
+                tuple(getattr(self, k) for k in FIELDS) + (self.TTL,))
+
+    def __repr__(self):
+        return "IPInformation({})".format(
+            ", ".join("{}={!r}".format(k, getattr(self, k)) for k in FIELDS)
+        )
+
+    def _asdict(self, ttl=False):
+        # With ttl=True, TTL is included too (when set).
+        dct = dict((k, getattr(self, k)) for k in FIELDS)
+        if ttl and self.TTL is not None:
+            dct["TTL"] = self.TTL
+        return dct
+
+    def _replace(self, **kwargs):
+        values = self._asdict(ttl=True)
+        values.update(kwargs)
+        return self.__class__(**values)
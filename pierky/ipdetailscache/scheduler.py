@@ -0,0 +1,217 @@
+# Copyright (c) 2016 Pier Carlo Chiodi - http://www.pierky.com
+# Licensed under The MIT License (MIT) - http://opensource.org/licenses/MIT
+
+"""Scheduling of RIPEStat fetches in priority lanes.
+
+A scheduler is passed to IPDetailsCache using its ``scheduler`` argument:
+the fetches needed by lookups are queued in the lane the lookup is tagged
+with (``lane`` argument of ``GetIPInformation``) and run by the workers of
+that lane, so that interactive lookups don't wait behind the fetches of a
+bulk backfill. Each lane has its own concurrency and share of the request
+rate."""
+
+import collections
+import threading
+
+from . import LANES, IPDetailsCacheError
+from .ratelimit import RateLimiter
+
+# Default concurrency and rate share of the lanes.
+DEFAULT_CONCURRENCY = {"interactive": 4, "bulk": 2, "refresh": 1}
+DEFAULT_SHARES = {"interactive": 0.6, "bulk": 0.3, "refresh": 0.1}
+
+QUEUED, RUNNING, DONE = range(3)
+
+
+class ScheduledCall(object):
+    """Result of a call queued in a FetchScheduler; same interface of
+    ``calls.Call`` (``wait`` and ``result``)."""
+
+    def __init__(self, key, func, args, lane):
+        self.key = key
+        self.lane = lane
+        self._func = func
+        self._args = args
+        self._state = QUEUED
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def _finish(self, result, error):
+        self._result = result
+        self._error = error
+        self._state = DONE
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """Wait for the call to complete; return False if the timeout
+        expired."""
+        return self._done.wait(timeout)
+
+    def result(self):
+        """Return the result of a complete call, or raise its error."""
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class FetchScheduler(object):
+    """Run calls in the ``interactive``, ``bulk`` and ``refresh`` lanes.
+
+    ``concurrency`` and ``shares`` are dicts {lane: value} that override
+    the default number of workers of each lane and its share of ``rate``
+    (requests per second, with bursts of ``burst``); with no ``rate``,
+    lanes are limited by their concurrency only.
+
+    Calls with the same key share the same queued or running call: when a
+    call queued in a lane is submitted again in a higher priority lane, it
+    is moved to that lane."""
+
+    def __init__(self, rate=None, burst=1, concurrency=None, shares=None):
+        concurrency = dict(DEFAULT_CONCURRENCY, **(concurrency or {}))
+        shares = dict(DEFAULT_SHARES, **(shares or {}))
+        for lane in set(concurrency) | set(shares):
+            if lane not in LANES:
+                raise ValueError("Unknown lane: {}".format(lane))
+        for lane in LANES:
+            if concurrency[lane] < 1:
+                raise ValueError("concurrency must be at least 1")
+            if not 0 < shares[lane] <= 1:
+                raise ValueError("shares must be between 0 and 1")
+
+        self.concurrency = concurrency
+        self.shares = shares
+        self.rate = rate
+
+        self._limiters = {}
+        if rate:
+            for lane in LANES:
+                self._limiters[lane] = RateLimiter(rate * shares[lane], burst)
+
+        self._lock = threading.Lock()
+        self._ready = dict((lane, threading.Condition(self._lock))
+                           for lane in LANES)
+        self._queues = dict((lane, collections.deque()) for lane in LANES)
+        # key -> ScheduledCall, for queued and running calls
+        self._calls = {}
+        self._workers = dict((lane, []) for lane in LANES)
+        self._closed = False
+        self._stats = dict(
+            (lane, {"Queued": 0, "Running": 0, "Completed": 0,
+                    "Deduplicated": 0, "Promoted": 0})
+            for lane in LANES
+        )
+
+    def submit(self, key, func, args=(), lane="interactive"):
+        """Queue ``func(*args)`` in ``lane``; return its ScheduledCall."""
+        if lane not in LANES:
+            raise ValueError("Unknown lane: {}".format(lane))
+
+        with self._lock:
+            if self._closed:
+                raise IPDetailsCacheError("Fetch scheduler closed")
+
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats[lane]["Deduplicated"] += 1
+                if call._state == QUEUED and \
+                        LANES.index(lane) < LANES.index(call.lane):
+                    # The entry left in the old lane's queue is skipped by
+                    # its workers.
+                    self._stats[call.lane]["Queued"] -= 1
+                    self._stats[lane]["Queued"] += 1
+                    self._stats[lane]["Promoted"] += 1
+                    call.lane = lane
+                    self._enqueue(call)
+                return call
+
+            call = ScheduledCall(key, func, args, lane)
+            self._calls[key] = call
+            self._stats[lane]["Queued"] += 1
+            self._enqueue(call)
+            return call
+
+    def _enqueue(self, call):
+        # Must be called with self._lock held.
+        lane = call.lane
+        self._queues[lane].append(call)
+        workers = self._workers[lane]
+        if len(workers) < self.concurrency[lane]:
+            worker = threading.Thread(
+                target=self._worker, args=(lane,),
+                name="IPDetailsCache {} fetches".format(lane)
+            )
+            worker.daemon = True
+            workers.append(worker)
+            worker.start()
+        self._ready[lane].notify()
+
+    def _next(self, lane):
+        # Return the next call of the lane, or None when closed.
+        queue = self._queues[lane]
+        with self._lock:
+            while True:
+                if self._closed:
+                    return None
+                while queue:
+                    call = queue.popleft()
+                    if call.lane == lane and call._state == QUEUED:
+                        call._state = RUNNING
+                        self._stats[lane]["Queued"] -= 1
+                        self._stats[lane]["Running"] += 1
+                        return call
+                self._ready[lane].wait()
+
+    def _worker(self, lane):
+        limiter = self._limiters.get(lane)
+        while True:
+            call = self._next(lane)
+            if call is None:
+                return
+
+            result = error = None
+            try:
+                if limiter:
+                    limiter.acquire()
+                result = call._func(*call._args)
+            except Exception as e:
+                error = e
+
+            with self._lock:
+                self._calls.pop(call.key, None)
+                self._stats[lane]["Running"] -= 1
+                self._stats[lane]["Completed"] += 1
+            call._finish(result, error)
+
+    def stats(self):
+        """Return a dict {lane: stats}; stats are the number of calls
+        Queued and Running, of the Completed ones, of the submissions that
+        joined a call already queued or running (Deduplicated) and of the
+        calls moved to the lane from a lower priority one (Promoted)."""
+        with self._lock:
+            return dict((lane, dict(stats))
+                        for lane, stats in self._stats.items())
+
+    def close(self):
+        """Stop the workers; calls still queued fail with
+        IPDetailsCacheError, running ones are completed."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            queued = [call for call in self._calls.values()
+                      if call._state == QUEUED]
+            for call in queued:
+                del self._calls[call.key]
+                self._stats[call.lane]["Queued"] -= 1
+            for ready in self._ready.values():
+                ready.notify_all()
+
+        for call in queued:
+            call._finish(None, IPDetailsCacheError("Fetch scheduler closed"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,174 @@
+# Copyright (c) 2016 Pier Carlo Chiodi - http://www.pierky.com
+# Licensed under The MIT License (MIT) - http://opensource.org/licenses/MIT
+
+"""Record and replay of RIPEStat and PeeringDB responses.
+
+A transport is passed to IPDetailsCache using its ``transport`` argument:
+all the requests sent to RIPEStat and PeeringDB go through its ``open``
+method, which returns ``(status, headers, body)``.
+
+``RecordingTransport`` sends requests and records responses to an archive;
+``ReplayTransport`` serves them back from the archive, without network
+access. Archives are gzip compressed files with one JSON object per line:
+a header followed by the responses, in the order they were received.
+Header names of responses are recorded and returned in lower case."""
+
+import gzip
+import json
+import threading
+import time
+
+try:
+    from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+except ImportError:
+    from urllib import urlencode
+    from urlparse import parse_qsl, urlsplit, urlunsplit
+
+from . import IPDetailsCache, IPDetailsCacheError
+
+ARCHIVE_FORMAT = "ipdetailscache-archive"
+ARCHIVE_VERSION = 1
+
+# Query parameters that change between a recording and its replay: they
+# are not used to index responses.
+VOLATILE_PARAMS = frozenset(["since"])
+
+
+def resource_key(url):
+    """Return the key responses to ``url`` are indexed by in archives."""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, True)
+             if k not in VOLATILE_PARAMS]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path,
+                       urlencode(sorted(query)), ""))
+
+
+def lower_case_headers(headers):
+    """Return a dict of ``headers`` with lower case names."""
+    if not headers:
+        return {}
+    return dict((name.lower(), value) for name, value in headers.items())
+
+
+class RecordingTransport(object):
+    """Send requests and record their responses to the ``path`` archive.
+
+    ``opener`` is the function used to send requests, with the same
+    signature of ``open`` (default: the one used by IPDetailsCache). Failed
+    requests are recorded too, and fail again when replayed. The archive is
+    complete only after ``close`` is called; transports can be used as
+    context managers."""
+
+    def __init__(self, path, opener=None):
+        self.path = path
+        self.opener = opener or IPDetailsCache._open_url
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, "wb")
+        self._write({"Format": ARCHIVE_FORMAT, "Version": ARCHIVE_VERSION,
+                     "TS": int(time.time())})
+
+    def _write(self, obj):
+        line = json.dumps(obj, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                raise IPDetailsCacheError("Recording transport closed")
+            self._file.write(line.encode("utf-8"))
+
+    def open(self, url, headers=None, timeout=None):
+        start = time.time()
+        try:
+            status, resp_headers, body = self.opener(url, headers, timeout)
+        except Exception as e:
+            self._write({"Key": resource_key(url), "URL": url,
+                         "Elapsed": time.time() - start, "Error": str(e)})
+            raise
+
+        resp_headers = lower_case_headers(resp_headers)
+        self._write({"Key": resource_key(url), "URL": url,
+                     "Elapsed": time.time() - start, "Status": status,
+                     "Headers": resp_headers, "Body": body})
+        return status, resp_headers, body
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ReplayTransport(object):
+    """Serve the responses recorded in the ``path`` archive.
+
+    Responses are looked up by URL, ignoring volatile query parameters
+    (``since``). When the same URL has been recorded more than once, its
+    responses are served in the same order and the last one is repeated.
+
+    ``latency`` simulates the network: a number of seconds each response is
+    delayed by, or ``"recorded"`` to use the time the original request
+    took. Requests whose response has not been recorded raise
+    IPDetailsCacheError."""
+
+    def __init__(self, path, latency=0):
+        self.path = path
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._responses = {}
+        self._served = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with gzip.open(self.path, "rb") as f:
+                header = json.loads(f.readline().decode("utf-8"))
+                if not isinstance(header, dict) or \
+                        header.get("Format") != ARCHIVE_FORMAT:
+                    raise ValueError("unknown format")
+                if header.get("Version") != ARCHIVE_VERSION:
+                    raise ValueError("unsupported version {}".format(
+                        header.get("Version")))
+                try:
+                    for line in f:
+                        response = json.loads(line.decode("utf-8"))
+                        self._responses.setdefault(response["Key"],
+                                                   []).append(response)
+                except EOFError:
+                    # Archives that have not been closed are truncated:
+                    # the responses read so far are used.
+                    pass
+        except (IOError, OSError, ValueError, KeyError) as e:
+            raise IPDetailsCacheError(
+                "Error reading archive {}: {}".format(self.path, str(e))
+            )
+
+    def __len__(self):
+        return sum(len(responses) for responses in self._responses.values())
+
+    def open(self, url, headers=None, timeout=None):
+        key = resource_key(url)
+        with self._lock:
+            responses = self._responses.get(key)
+            if not responses:
+                raise IPDetailsCacheError(
+                    "No recorded response for {}".format(url)
+                )
+            idx = self._served.get(key, 0)
+            self._served[key] = idx + 1
+        response = responses[min(idx, len(responses) - 1)]
+
+        delay = response["Elapsed"] if self.latency == "recorded" \
+            else self.latency
+        if delay:
+            time.sleep(delay)
+
+        if "Error" in response:
+            raise IPDetailsCacheError(
+                "Recorded error for {}: {}".format(url, response["Error"])
+            )
+        return response["Status"], lower_case_headers(response["Headers"]), \
+            response["Body"]
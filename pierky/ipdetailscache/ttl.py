@@ -0,0 +1,79 @@
+# Copyright (c) 2016 Pier Carlo Chiodi - http://www.pierky.com
+# Licensed under The MIT License (MIT) - http://opensource.org/licenses/MIT
+
+"""Policies that set the time to live of the entries of the cache.
+
+A policy is passed to IPDetailsCache using its ``ttl_policy`` argument:
+every time a prefix is fetched from RIPEStat, its ``ttl`` method gives the
+TTL of the new entry. The TTL is stored in the prefix entry (and in the
+address entries that are built on it) and persisted with it; entries
+without a TTL expire after the cache's MAX_CACHE."""
+
+
+def changed(old, new):
+    """Return True if ASN, Holder or Prefix of ``new`` differ from
+    ``old``'s."""
+    return old["ASN"] != new["ASN"] or \
+        old.get("Holder", "") != new.get("Holder", "") or \
+        old["Prefix"] != new["Prefix"]
+
+
+class TTLPolicy(object):
+    """Base class of TTL policies.
+
+    ``ttl`` is called with ``old``, the entry of the prefix the address
+    belonged to before (None if nothing was known about it), and ``new``,
+    the one just fetched. Both are dicts with TS, ASN, Holder and Prefix,
+    and ``old`` also with the keys previously stored by the policy. It
+    returns the TTL of the new entry, in seconds; other keys the policy
+    stores in ``new`` are persisted with the prefix entry."""
+
+    def ttl(self, old, new):
+        raise NotImplementedError()
+
+
+class FixedTTLPolicy(TTLPolicy):
+    """The same TTL for all the entries."""
+
+    def __init__(self, ttl=604800):
+        self.TTL = ttl
+
+    def ttl(self, old, new):
+        return self.TTL
+
+
+class AdaptiveTTLPolicy(TTLPolicy):
+    """TTL driven by the churn observed on each prefix.
+
+    New prefixes get ``initial_ttl``. When a refresh finds the same ASN,
+    Holder and Prefix the TTL is multiplied by ``factor``, up to
+    ``max_ttl``; when something changed it drops to ``min_ttl``. The number
+    of consecutive refreshes without changes is stored in the ``Stable``
+    key of the prefix entry."""
+
+    def __init__(self, min_ttl=86400, initial_ttl=604800,
+                 max_ttl=604800 * 8, factor=2):
+        if not 0 < min_ttl <= initial_ttl <= max_ttl:
+            raise ValueError("TTLs must be 0 < min_ttl <= initial_ttl <= "
+                             "max_ttl")
+        if factor < 1:
+            raise ValueError("factor must be at least 1")
+
+        self.min_ttl = min_ttl
+        self.initial_ttl = initial_ttl
+        self.max_ttl = max_ttl
+        self.factor = factor
+
+    def ttl(self, old, new):
+        if old is None:
+            new["Stable"] = 0
+            return self.initial_ttl
+
+        if changed(old, new):
+            new["Stable"] = 0
+            return self.min_ttl
+
+        new["Stable"] = old.get("Stable", 0) + 1
+        return int(min(self.max_ttl,
+                       max(self.min_ttl,
+                           old.get("TTL", self.initial_ttl) * self.factor)))
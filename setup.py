@@ -34,9 +34,7 @@ setup(
     maintainer="Pier Carlo Chiodi",
     maintainer_email="pierky@pierky.com",
 
-    install_requires=[
-        "IPy>=0.83",
-    ],
+    install_requires=[],
     tests_require=[
         "nose",
         "coverage",
@@ -0,0 +1,111 @@
+import unittest
+
+
+from pierky.ipdetailscache.addresses import AddressNormaliser, PrefixTable, \
+                                            RangeTable, format_ip, \
+                                            is_globally_routable, parse_ip, \
+                                            parse_prefix
+
+
+class TestAddresses(unittest.TestCase):
+
+    def test_parse_ipv4(self):
+        """Addresses, IPv4 parsing"""
+        self.assertEqual(parse_ip("193.0.6.1"), (4, 0xC1000601))
+        self.assertEqual(format_ip((4, 0xC1000601)), "193.0.6.1")
+
+    def test_parse_ipv6(self):
+        """Addresses, IPv6 parsing and exploded form"""
+        key = parse_ip("2001:DB8::1")
+        self.assertEqual(key, (6, 0x20010db8 << 96 | 1))
+        self.assertEqual(format_ip(key),
+                         "2001:0db8:0000:0000:0000:0000:0000:0001")
+        self.assertEqual(parse_ip(format_ip(key)), key)
+
+    def test_parse_invalid(self):
+        """Addresses, invalid input"""
+        for ip in ["", "1.2.3", "193.0.6.256", "2001:db8::1::1", "foo"]:
+            with self.assertRaises(ValueError):
+                parse_ip(ip)
+        for prefix in ["193.0.0.0/33", "193.0.0.0/x", "2001:db8::/129"]:
+            with self.assertRaises(ValueError):
+                parse_prefix(prefix)
+
+    def test_parse_prefix(self):
+        """Addresses, prefix parsing"""
+        self.assertEqual(parse_prefix("193.0.6.1/21"), (4, 0xC1000000, 21))
+        self.assertEqual(parse_prefix("80.81.192.1"), (4, 0x5051C001, 32))
+        self.assertEqual(parse_prefix("2001:db8::/32"),
+                         (6, 0x20010db8 << 96, 32))
+
+    def test_normaliser(self):
+        """Addresses, normaliser memo and fast path"""
+        n = AddressNormaliser(size=2)
+        key = n.normalise("193.0.6.1")
+        self.assertIs(n.normalise("193.0.6.1"), key)
+        self.assertIs(n.normalise(key), key)
+        n.normalise("193.0.6.2")
+        n.normalise("193.0.6.3")
+        self.assertLessEqual(len(n._memo), 2)
+
+    def test_prefix_table(self):
+        """Addresses, longest match prefix table"""
+        t = PrefixTable()
+        t.add("193.0.0.0/16", "a")
+        t.add("193.0.0.0/21", "b")
+        t.add("2001:db8::/32", "c")
+        self.assertEqual(len(t), 3)
+        self.assertEqual(t.lookup(parse_ip("193.0.6.1")), "b")
+        self.assertEqual(list(t.lookup_all(parse_ip("193.0.6.1"))),
+                         ["b", "a"])
+        self.assertEqual(t.lookup(parse_ip("193.0.22.1")), "a")
+        self.assertIsNone(t.lookup(parse_ip("193.1.0.1")))
+        self.assertEqual(t.lookup(parse_ip("2001:db8::1")), "c")
+        t.remove("193.0.0.0/21")
+        self.assertEqual(t.lookup(parse_ip("193.0.6.1")), "a")
+
+    def test_globally_routable(self):
+        """Addresses, globally routable"""
+        for ip in ["193.0.6.1", "2001:67c:2e8::1"]:
+            self.assertTrue(is_globally_routable(parse_ip(ip)))
+        for ip in ["10.0.0.1", "127.0.0.1", "192.168.1.1", "::1", "::",
+                   "fe80::1", "fc00::1", "2001:db8::1", "100.64.0.1",
+                   "198.18.0.1", "198.51.100.1", "203.0.113.1", "224.0.0.1",
+                   "255.255.255.255", "2001:2::1", "3fff::1", "ff02::1"]:
+            self.assertFalse(is_globally_routable(parse_ip(ip)))
+
+    def test_range_table(self):
+        """Addresses, range table"""
+        t = RangeTable(["193.0.0.0/21", "193.0.8.0/21", "193.0.4.0/24",
+                        "2001:db8::/32"])
+        # adjacent and overlapping prefixes are merged
+        self.assertEqual(len(t), 2)
+        for ip in ["193.0.0.0", "193.0.6.1", "193.0.15.255", "2001:db8::1"]:
+            self.assertIn(parse_ip(ip), t)
+        for ip in ["192.255.255.255", "193.0.16.0", "2001:db9::1"]:
+            self.assertNotIn(parse_ip(ip), t)
+
+        t2 = t.extend(["10.0.0.0/8"])
+        self.assertIn(parse_ip("10.1.1.1"), t2)
+        self.assertNotIn(parse_ip("10.1.1.1"), t)
+        self.assertFalse(is_globally_routable(parse_ip("193.0.6.1"), t2))
+
+    def test_wrappers(self):
+        """Addresses, legacy IPWrapper and NetWrapper"""
+        from pierky.ipdetailscache import IPWrapper, NetWrapper
+
+        ip = IPWrapper("2001:db8::1")
+        self.assertEqual(ip.get_version(), 6)
+        self.assertEqual(ip.exploded(),
+                         "2001:0db8:0000:0000:0000:0000:0000:0001")
+        self.assertFalse(ip.is_globally_routable())
+
+        ip = IPWrapper("193.0.6.1")
+        self.assertEqual(ip.get_version(), 4)
+        self.assertTrue(ip.is_globally_routable())
+        self.assertTrue(NetWrapper("193.0.0.0/21").contains(ip))
+        self.assertFalse(NetWrapper("193.0.8.0/21").contains(ip))
+        self.assertFalse(NetWrapper("2001:db8::/32").contains(ip))
+
+        with self.assertRaises(ValueError):
+            IPWrapper("foo")
@@ -0,0 +1,118 @@
+import json
+import mock
+import os
+import shutil
+import tempfile
+import time
+
+
+from base_class import TestIPDetailsCacheBase
+from pierky.ipdetailscache import IPDetailsCache
+
+
+class TestAutosave(TestIPDetailsCacheBase):
+    LIVE = False
+
+    def setUp(self):
+        TestIPDetailsCacheBase.setUp(self)
+
+        self.dir = tempfile.mkdtemp()
+        self.addr_file = os.path.join(self.dir, "ip_addr.cache")
+        self.pref_file = os.path.join(self.dir, "ip_pref.cache")
+
+        self.mock_save = mock.patch.object(
+            IPDetailsCache,
+            "_save_json_file",
+            autospec=True,
+            side_effect=IPDetailsCache._save_json_file
+        ).start()
+
+    def tearDown(self):
+        TestIPDetailsCacheBase.tearDown(self)
+        shutil.rmtree(self.dir)
+
+    def get_cache(self, **kwargs):
+        return IPDetailsCache(IP_ADDRESSES_CACHE_FILE=self.addr_file,
+                              IP_PREFIXES_CACHE_FILE=self.pref_file,
+                              dont_save_on_del=True, **kwargs)
+
+    def load_addresses(self):
+        with open(self.addr_file) as f:
+            if f.read(1) == "":
+                return {}
+            f.seek(0)
+            return json.load(f)
+
+    def wait_for_save(self, calls):
+        for _ in range(100):
+            if self.mock_save.call_count >= calls:
+                return
+            time.sleep(0.05)
+        self.fail("Cache not saved")
+
+    def test_save_only_when_dirty(self):
+        """Autosave, cache saved only when dirty"""
+        cache = self.get_cache()
+        self.assertFalse(cache.IsCacheDirty())
+        cache.SaveCache()
+        self.assertEqual(self.mock_save.call_count, 0)
+
+        cache.GetIPInformation(self.IP)
+        self.assertTrue(cache.IsCacheDirty())
+        cache.SaveCache()
+        self.assertEqual(self.mock_save.call_count, 2)
+        self.assertFalse(cache.IsCacheDirty())
+        self.assertIn(self.IP, self.load_addresses())
+
+        cache.GetIPInformation(self.IP)
+        cache.SaveCache()
+        self.assertEqual(self.mock_save.call_count, 2)
+
+        cache.SaveCache(force=True)
+        self.assertEqual(self.mock_save.call_count, 4)
+
+    def test_save_failure(self):
+        """Autosave, changes still pending after a failed save"""
+        cache = self.get_cache()
+        cache.GetIPInformation(self.IP)
+
+        self.mock_save.side_effect = IOError("disk full")
+        with self.assertRaises(IOError):
+            cache.SaveCache()
+        self.assertTrue(cache.IsCacheDirty())
+
+    def test_autosave_changes(self):
+        """Autosave, after M changes"""
+        cache = self.get_cache(autosave_changes=3)
+        cache.GetIPInformation(self.IP)
+        time.sleep(0.2)
+        self.assertEqual(self.mock_save.call_count, 0)
+
+        cache.GetIPInformation(self.SAME_AS_DIFFERENT_PREFIX_IP)
+        self.wait_for_save(2)
+        self.assertEqual(len(self.load_addresses()), 2)
+        cache.close()
+
+    def test_autosave_interval(self):
+        """Autosave, every N seconds"""
+        cache = self.get_cache(autosave_interval=0.1)
+        time.sleep(0.3)
+        self.assertEqual(self.mock_save.call_count, 0)
+
+        cache.GetIPInformation(self.IP)
+        self.wait_for_save(2)
+        self.assertIn(self.IP, self.load_addresses())
+        cache.close()
+
+    def test_context_manager(self):
+        """Autosave, close() via context manager"""
+        with self.get_cache(autosave_interval=60) as cache:
+            cache.GetIPInformation(self.IP)
+            self.assertEqual(self.mock_save.call_count, 0)
+
+        self.assertEqual(self.mock_save.call_count, 2)
+        self.assertFalse(cache.IsCacheDirty())
+        self.assertIn(self.IP, self.load_addresses())
+
+        cache.close()
+        self.assertEqual(self.mock_save.call_count, 2)
@@ -54,6 +54,12 @@ class TestIPDetailsCacheBase(unittest.TestCase):
     def shortDescription(self):
         return self._testMethodDoc.format(" (LIVE)" if self.LIVE else "")
 
+    def expire_addresses(self):
+        # Address entries are immutable: they are replaced by expired
+        # copies.
+        for k, entry in list(self.cache.IPAddressesCache.items()):
+            self.cache.IPAddressesCache[k] = entry._replace(TS=0)
+
     def verify_fetchipinfo_calls(self, val):
         if self.LIVE:
             self.assertEquals(self.cache.FetchIPInfo.call_count, val)
@@ -127,8 +133,7 @@ class TestIPDetailsCacheBaseTests(TestIPDetailsCacheBase):
         """Fake cache, expired entries{}"""
         ip = self.cache.GetIPInformation(self.IP)
 
-        for k in self.cache.IPAddressesCache.keys():
-            self.cache.IPAddressesCache[k]["TS"] = 0
+        self.expire_addresses()
 
         for k in self.cache.IPPrefixesCache.keys():
             self.cache.IPPrefixesCache[k]["TS"] = 0
@@ -142,8 +147,7 @@ class TestIPDetailsCacheBaseTests(TestIPDetailsCacheBase):
         """Fake cache, expired IP, valid prefix{}"""
         ip = self.cache.GetIPInformation(self.IP)
 
-        for k in self.cache.IPAddressesCache.keys():
-            self.cache.IPAddressesCache[k]["TS"] = 0
+        self.expire_addresses()
 
         ip = self.cache.GetIPInformation(self.IP)
 
@@ -0,0 +1,32 @@
+from base_class import TestIPDetailsCacheBase
+from pierky.ipdetailscache import IPDetailsCache
+
+
+class TestBogons(TestIPDetailsCacheBase):
+    LIVE = False
+
+    def test_special_purpose(self):
+        """Bogons, special-purpose addresses are not fetched"""
+        for ip in ["100.64.0.1", "198.18.0.1", "192.0.2.1", "2001:db8::1"]:
+            res = self.cache.GetIPInformation(ip)
+            self.assertEqual(res["ASN"], "unknown")
+        self.verify_fetchipinfo_calls(0)
+        self.assertEqual(len(self.cache.IPAddressesCache), 0)
+
+    def test_user_bogons(self):
+        """Bogons, user-defined ranges"""
+        self.cache = IPDetailsCache(IP_ADDRESSES_CACHE_FILE=None,
+                                    IP_PREFIXES_CACHE_FILE=None,
+                                    bogons=["193.0.0.0/21"])
+        res = self.cache.GetIPInformation(self.IP)
+        self.assertEqual(res["ASN"], "unknown")
+        res = self.cache.GetIPInformation(self.SAME_AS_DIFFERENT_PREFIX_IP)
+        self.assertEqual(res["ASN"], self.ASN)
+        self.verify_fetchipinfo_calls(1)
+
+    def test_invalid_bogons(self):
+        """Bogons, invalid prefix"""
+        with self.assertRaises(ValueError):
+            IPDetailsCache(IP_ADDRESSES_CACHE_FILE=None,
+                           IP_PREFIXES_CACHE_FILE=None,
+                           dont_save_on_del=True, bogons=["foo"])
@@ -0,0 +1,150 @@
+import mock
+import threading
+import time
+
+
+from base_class import TestIPDetailsCacheBase
+from pierky.ipdetailscache import IPDetailsCache, PENDING
+
+
+class TestDeadline(TestIPDetailsCacheBase):
+    LIVE = False
+
+    def setUp(self):
+        TestIPDetailsCacheBase.setUp(self)
+        self.mock_getfqdn = mock.patch(
+            "socket.getfqdn", return_value="host.example.com"
+        ).start()
+
+    def slow_fetchipinfo(self, delays):
+        # The n-th call to FetchIPInfo takes delays[n] seconds.
+        calls = []
+
+        def fetchipinfo(cache, ip):
+            calls.append(ip)
+            time.sleep(delays[min(len(calls), len(delays)) - 1])
+            return TestIPDetailsCacheBase.MOCK_RESULTS[ip]
+
+        self.mock_fetchipinfo.side_effect = fetchipinfo
+
+    def wait_inflight(self):
+        while self.cache._inflight:
+            time.sleep(0.01)
+
+    def test_pending(self):
+        """Deadline, pending marker"""
+        self.slow_fetchipinfo([0.3])
+
+        start = time.time()
+        res = self.cache.GetIPInformation(self.IP, timeout=0.05)
+        self.assertLess(time.time() - start, 0.25)
+        self.assertIs(res, PENDING)
+        self.assertEqual(res["ASN"], "pending")
+
+        # the fetch goes on in background and fills the prefixes cache
+        self.wait_inflight()
+        self.assertIn(self.PREFIX, self.cache.IPPrefixesCache)
+        self.assertTrue(self.cache.IsCacheDirty())
+
+        res = self.cache.GetIPInformation(self.SAME_PREFIX_IP, timeout=0.05)
+        self.assertEqual(res["ASN"], self.ASN)
+        self.verify_fetchipinfo_calls(1)
+
+    def test_inflight_shared(self):
+        """Deadline, lookups share in-flight fetches"""
+        self.slow_fetchipinfo([0.3])
+
+        for _ in range(3):
+            self.cache.GetIPInformation(self.IP, timeout=0.01)
+        res = self.cache.GetIPInformation(self.IP, timeout=1)
+        self.assertEqual(res["ASN"], self.ASN)
+        self.verify_fetchipinfo_calls(1)
+
+    def test_stale_address(self):
+        """Deadline, stale address entry"""
+        orig = self.cache.GetIPInformation(self.IP)
+        self.expire_addresses()
+        for k in self.cache.IPPrefixesCache.keys():
+            self.cache.IPPrefixesCache[k]["TS"] = 0
+        stale = self.cache.IPAddressesCache[(4, 0xC1000601)]
+
+        self.slow_fetchipinfo([0.3])
+        res = self.cache.GetIPInformation(self.IP, timeout=0.05)
+        self.assertIs(res, stale)
+        self.assertEqual(res["ASN"], orig["ASN"])
+        self.wait_inflight()
+
+    def test_stale_prefix(self):
+        """Deadline, stale prefix entry"""
+        self.cache.GetIPInformation(self.IP, fields="asn")
+        for k in self.cache.IPPrefixesCache.keys():
+            self.cache.IPPrefixesCache[k]["TS"] = 0
+
+        self.slow_fetchipinfo([0.3])
+        res = self.cache.GetIPInformation(self.IP, timeout=0.05)
+        self.assertEqual(res["ASN"], self.ASN)
+        self.assertEqual(res["Prefix"], self.PREFIX)
+        self.assertIsNone(res["HostName"])
+        self.wait_inflight()
+
+    def test_slow_dns(self):
+        """Deadline, reverse DNS timeout"""
+        done = threading.Event()
+
+        def getfqdn(ip):
+            done.wait(1)
+            return "host.example.com"
+
+        self.mock_getfqdn.side_effect = getfqdn
+
+        res = self.cache.GetIPInformation(self.IP, timeout=0.05)
+        self.assertEqual(res["ASN"], self.ASN)
+        self.assertIsNone(res["HostName"])
+
+        done.set()
+        res = self.cache.GetIPInformation(self.IP)
+        self.assertEqual(res["HostName"], "host.example.com")
+        self.verify_fetchipinfo_calls(1)
+
+    def test_hedging(self):
+        """Deadline, hedged request"""
+        self.cache = IPDetailsCache(IP_ADDRESSES_CACHE_FILE=None,
+                                    IP_PREFIXES_CACHE_FILE=None,
+                                    hedge_delay=0.05)
+        self.slow_fetchipinfo([1, 0])
+
+        start = time.time()
+        res = self.cache.GetIPInformation(self.IP)
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(res["ASN"], self.ASN)
+        self.verify_fetchipinfo_calls(2)
+
+    def test_no_hedging(self):
+        """Deadline, no hedged request for fast responses"""
+        self.cache = IPDetailsCache(IP_ADDRESSES_CACHE_FILE=None,
+                                    IP_PREFIXES_CACHE_FILE=None,
+                                    hedge_delay=0.2)
+        self.slow_fetchipinfo([0])
+        self.cache.GetIPInformation(self.IP)
+        self.verify_fetchipinfo_calls(1)
+
+    def test_fetch_timeout(self):
+        """Deadline, timeout of HTTP requests"""
+        with mock.patch("pierky.ipdetailscache.urlopen") as mock_urlopen:
+            mock_urlopen.return_value.read.return_value = b"{}"
+            IPDetailsCache._read_from_url("http://localhost/", 5)
+            mock_urlopen.assert_called_with("http://localhost/", timeout=5)
+            IPDetailsCache._read_from_url("http://localhost/")
+            mock_urlopen.assert_called_with("http://localhost/")
+
+    def test_prefix_not_covering(self):
+        """Deadline, resource not covering the address, no scheduler"""
+        self.mock_fetchipinfo.side_effect = lambda cache, ip: {
+            "status": "ok",
+            "data": {"resource": "194.0.0.0/21",
+                     "asns": [{"asn": 1, "holder": ""}]}
+        }
+        res = self.cache.GetIPInformation("193.0.6.139", timeout=1)
+        self.assertEqual(res["ASN"], "1")
+        self.assertEqual(res["Prefix"], "194.0.0.0/21")
+        self.verify_fetchipinfo_calls(1)
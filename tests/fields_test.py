@@ -0,0 +1,88 @@
+import json
+import mock
+from time import time
+
+
+from base_class import TestIPDetailsCacheBase
+from pierky.ipdetailscache import IPDetailsCache
+
+
+class TestFields(TestIPDetailsCacheBase):
+    LIVE = False
+
+    def setUp(self):
+        TestIPDetailsCacheBase.setUp(self)
+        self.mock_getfqdn = mock.patch(
+            "socket.getfqdn", return_value="host.example.com"
+        ).start()
+
+        with open("tests/data/ixps.json", "r") as f:
+            data = json.loads(f.read())
+            data["TS"] = int(time())
+        self.cache.IXPsCache = data
+        self.cache.UseIXPsCache = 2
+
+    def test_asn_profile(self):
+        """Fields, ASN profile"""
+        for ip in [self.IP, self.SAME_PREFIX_IP, self.IXPS_ANNOUNCED_IP]:
+            res = self.cache.GetIPInformation(ip, fields="asn")
+            self.assertIsNone(res["HostName"])
+            self.assertIsNone(res["IsIXP"])
+
+        self.assertEqual(res["ASN"], self.IXPS_ANNOUNCED_IP_ASN)
+        self.verify_fetchipinfo_calls(2)
+        self.assertEqual(self.mock_getfqdn.call_count, 0)
+
+        # prefix only: no address entries
+        self.assertEqual(len(self.cache.IPAddressesCache), 0)
+        self.assertEqual(len(self.cache.IPPrefixesCache), 2)
+
+    def test_unicode_profile(self):
+        """Fields, profile name given as unicode string"""
+        res = self.cache.GetIPInformation(self.IP, fields=u"asn")
+        self.assertEqual(res["ASN"], self.ASN)
+        self.assertIsNone(res["HostName"])
+        self.assertEqual(len(self.cache.IPAddressesCache), 0)
+
+    def test_fields(self):
+        """Fields, HostName without IXPs info"""
+        res = self.cache.GetIPInformation(self.IXPS_ANNOUNCED_IP,
+                                          fields=["ASN", "HostName"])
+        self.assertEqual(res["HostName"], "host.example.com")
+        self.assertIsNone(res["IsIXP"])
+        self.assertEqual(len(self.cache.IPAddressesCache), 1)
+
+    def test_lazy_fill(self):
+        """Fields, fields not computed are filled later"""
+        res = self.cache.GetIPInformation(self.IXPS_ANNOUNCED_IP,
+                                          fields=["ASN", "IsIXP"])
+        self.assertIsNone(res["HostName"])
+        self.assertEqual(res["IsIXP"], True)
+        self.assertEqual(self.mock_getfqdn.call_count, 0)
+
+        res = self.cache.GetIPInformation(self.IXPS_ANNOUNCED_IP)
+        self.assertEqual(res["HostName"], "host.example.com")
+        self.assertEqual(res["IXPName"], self.IXPS_ANNOUNCED_IP_IXPNAME)
+        self.assertEqual(self.mock_getfqdn.call_count, 1)
+        self.verify_fetchipinfo_calls(1)
+
+        # stored in the cache
+        res = self.cache.GetIPInformation(self.IXPS_ANNOUNCED_IP)
+        self.assertEqual(res["HostName"], "host.example.com")
+        self.assertEqual(self.mock_getfqdn.call_count, 1)
+
+    def test_asn_then_full(self):
+        """Fields, ASN profile, then full lookup"""
+        self.cache.GetIPInformation(self.IP, fields="asn")
+        res = self.cache.GetIPInformation(self.IP)
+
+        self.assertEqual(res["ASN"], self.ASN)
+        self.assertEqual(res["IsIXP"], False)
+        self.verify_fetchipinfo_calls(1)
+
+    def test_unknown_fields(self):
+        """Fields, unknown fields or profiles"""
+        with self.assertRaises(ValueError):
+            self.cache.GetIPInformation(self.IP, fields="foo")
+        with self.assertRaises(ValueError):
+            self.cache.GetIPInformation(self.IP, fields=["ASN", "foo"])
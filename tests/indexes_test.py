@@ -0,0 +1,129 @@
+import mock
+import os
+import shutil
+import tempfile
+from time import time
+
+
+from base_class import TestIPDetailsCacheBase
+from pierky.ipdetailscache import IPDetailsCache
+
+
+class TestIndexes(TestIPDetailsCacheBase):
+    LIVE = False
+
+    def setUp(self):
+        TestIPDetailsCacheBase.setUp(self)
+        mock.patch("socket.getfqdn", return_value="host.example.com").start()
+
+    def populate(self):
+        for ip in [self.IP, self.SAME_PREFIX_IP,
+                   self.SAME_AS_DIFFERENT_PREFIX_IP, self.NOT_ANNOUNCED_IP]:
+            self.cache.GetIPInformation(ip)
+
+    def test_queries(self):
+        """Indexes, queries"""
+        self.populate()
+
+        self.assertEqual(sorted(self.cache.GetPrefixesByASN(self.ASN)),
+                         ["193.0.0.0/21", "193.0.22.0/23"])
+        self.assertEqual(sorted(self.cache.GetPrefixesByASN(3333)),
+                         ["193.0.0.0/21", "193.0.22.0/23"])
+        self.assertEqual(list(self.cache.GetPrefixesByASN("not announced")),
+                         [self.NOT_ANNOUNCED_IP])
+        self.assertEqual(self.cache.GetPrefixesByASN("1"), {})
+
+        addresses = self.cache.GetAddressesInPrefix(self.PREFIX)
+        self.assertEqual(sorted(addresses), [self.IP, self.SAME_PREFIX_IP])
+        self.assertEqual(addresses[self.IP]["ASN"], self.ASN)
+        self.assertEqual(self.cache.GetAddressesInPrefix("10.0.0.0/8"), {})
+
+        self.assertEqual(self.cache.GetASNsByHolder(self.HOLDER),
+                         set([self.ASN]))
+        self.assertEqual(self.cache.GetASNsByHolder("foo"), set())
+
+    def test_update(self):
+        """Indexes, updated when entries change"""
+        self.populate()
+
+        now = int(time())
+        self.cache.MergeCache({}, {
+            self.PREFIX: {"TS": now + 1, "ASN": "1", "Holder": "NEW"}
+        })
+        self.assertEqual(list(self.cache.GetPrefixesByASN(self.ASN)),
+                         ["193.0.22.0/23"])
+        self.assertEqual(list(self.cache.GetPrefixesByASN("1")),
+                         [self.PREFIX])
+        self.assertEqual(self.cache.GetASNsByHolder("NEW"), set(["1"]))
+        self.assertEqual(self.cache.GetASNsByHolder(self.HOLDER),
+                         set([self.ASN]))
+
+        entry = self.cache.IPAddressesCache[(4, 0xC1000601)]
+        self.cache.MergeCache(
+            {self.IP: entry._replace(TS=now + 1, Prefix="193.0.6.0/24")}, {}
+        )
+        self.assertEqual(list(self.cache.GetAddressesInPrefix(self.PREFIX)),
+                         [self.SAME_PREFIX_IP])
+        self.assertEqual(
+            list(self.cache.GetAddressesInPrefix("193.0.6.0/24")), [self.IP]
+        )
+
+    def test_expired(self):
+        """Indexes, expired entries"""
+        self.populate()
+        self.expire_addresses()
+        self.cache.IPPrefixesCache[self.PREFIX] = dict(
+            self.cache.IPPrefixesCache[self.PREFIX], TS=0
+        )
+
+        self.assertEqual(self.cache.GetAddressesInPrefix(self.PREFIX), {})
+        self.assertEqual(
+            len(self.cache.GetAddressesInPrefix(self.PREFIX,
+                                                include_expired=True)), 2
+        )
+        self.assertEqual(list(self.cache.GetPrefixesByASN(self.ASN)),
+                         ["193.0.22.0/23"])
+
+        self.assertEqual(self.cache.PurgeExpired(), (4, 1))
+        self.assertTrue(self.cache.IsCacheDirty())
+        self.assertEqual(len(self.cache.IPAddressesCache), 0)
+        self.assertNotIn(self.PREFIX, self.cache.IPPrefixesCache)
+        self.assertEqual(
+            self.cache.GetAddressesInPrefix(self.PREFIX,
+                                            include_expired=True), {}
+        )
+        self.assertEqual(
+            list(self.cache.GetPrefixesByASN(self.ASN,
+                                             include_expired=True)),
+            ["193.0.22.0/23"]
+        )
+        self.assertEqual(self.cache.GetASNsByHolder(self.HOLDER),
+                         set([self.ASN]))
+
+        # purged prefixes are fetched again
+        self.cache.GetIPInformation(self.IP)
+        self.verify_fetchipinfo_calls(4)
+
+    def test_load(self):
+        """Indexes, built when the cache is loaded"""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            kwargs = {
+                "IP_ADDRESSES_CACHE_FILE": os.path.join(tmp_dir, "addr"),
+                "IP_PREFIXES_CACHE_FILE": os.path.join(tmp_dir, "pref")
+            }
+            self.cache = IPDetailsCache(**kwargs)
+            self.populate()
+            self.cache.SaveCache()
+
+            for lazy_load in [False, True]:
+                cache = IPDetailsCache(dont_save_on_del=True,
+                                       lazy_load=lazy_load, **kwargs)
+                cache.WaitCacheReady()
+                self.assertEqual(len(cache.GetPrefixesByASN(self.ASN)), 2)
+                self.assertEqual(len(cache.GetAddressesInPrefix(self.PREFIX)),
+                                 2)
+                self.assertEqual(cache.GetASNsByHolder(self.HOLDER),
+                                 set([self.ASN]))
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -0,0 +1,138 @@
+import json
+import mock
+import os
+import shutil
+import tempfile
+from time import time
+
+
+from base_class import TestIPDetailsCacheBase
+from pierky.ipdetailscache import IPDetailsCache
+
+
+def fetchipinfo(self, ip):
+    if ":" in ip:
+        return {"status": "ok",
+                "data": {"resource": "2001:67c:2e8::/48",
+                         "asns": [{"asn": 3333, "holder": "RIPE-NCC-AS"}]}}
+    return TestIPDetailsCacheBase.MOCK_RESULTS[ip]
+
+
+class TestIPv6Aggregation(TestIPDetailsCacheBase):
+    LIVE = False
+
+    IPS = ["2001:67c:2e8:22::c100:68b", "2001:67c:2e8:22::1",
+           "2001:67c:2e8:22:a:b:c:d", "2001:67c:2e8:23::1"]
+
+    def setUp(self):
+        TestIPDetailsCacheBase.setUp(self)
+        self.mock_fetchipinfo.side_effect = fetchipinfo
+        self.mock_getfqdn = mock.patch(
+            "socket.getfqdn", return_value="host.example.com"
+        ).start()
+
+    def get_cache(self, **kwargs):
+        return IPDetailsCache(IP_ADDRESSES_CACHE_FILE=None,
+                              IP_PREFIXES_CACHE_FILE=None, **kwargs)
+
+    def test_no_aggregation(self):
+        """IPv6 aggregation, disabled by default"""
+        cache = self.get_cache()
+        for ip in self.IPS:
+            res = cache.GetIPInformation(ip)
+            self.assertEqual(res["ASN"], "3333")
+
+        res = cache.GetIPInformation(self.IPS[0])
+        self.assertEqual(res["HostName"], "host.example.com")
+
+        self.assertEqual(len(cache.IPAddressesCache), 4)
+        self.verify_fetchipinfo_calls(1)
+
+    def test_aggregation_64(self):
+        """IPv6 aggregation, /64"""
+        cache = self.get_cache(ipv6_aggregation=64)
+        for ip in self.IPS:
+            res = cache.GetIPInformation(ip)
+            self.assertEqual(res["ASN"], "3333")
+            self.assertEqual(res["Prefix"], "2001:67c:2e8::/48")
+            self.assertEqual(res["HostName"], "")
+
+        self.assertEqual(len(cache.IPAddressesCache), 2)
+        self.assertEqual(len(cache.IPPrefixesCache), 1)
+        self.verify_fetchipinfo_calls(1)
+        self.assertEqual(self.mock_getfqdn.call_count, 0)
+
+        # IPv4 addresses are not affected
+        res = cache.GetIPInformation(self.IP)
+        self.assertEqual(res["HostName"], "host.example.com")
+        self.assertEqual(len(cache.IPAddressesCache), 3)
+
+    def test_prefix_only(self):
+        """IPv6 aggregation, prefix only"""
+        cache = self.get_cache(ipv6_prefix_only=True)
+        for ip in self.IPS:
+            res = cache.GetIPInformation(ip)
+            self.assertEqual(res["ASN"], "3333")
+            self.assertEqual(res["Prefix"], "2001:67c:2e8::/48")
+
+        self.assertEqual(len(cache.IPAddressesCache), 0)
+        self.assertEqual(len(cache.IPPrefixesCache), 1)
+        self.verify_fetchipinfo_calls(1)
+        self.assertEqual(cache._prefixes_changes, 1)
+
+    def test_load(self):
+        """IPv6 aggregation, cache file saved without aggregation"""
+        dir = tempfile.mkdtemp()
+        try:
+            addr_file = os.path.join(dir, "ip_addr.cache")
+            cache = IPDetailsCache(IP_ADDRESSES_CACHE_FILE=addr_file,
+                                   IP_PREFIXES_CACHE_FILE=None,
+                                   dont_save_on_del=True)
+            for ip in self.IPS + [self.IP]:
+                cache.GetIPInformation(ip)
+            cache.SaveCache()
+
+            cache = IPDetailsCache(IP_ADDRESSES_CACHE_FILE=addr_file,
+                                   IP_PREFIXES_CACHE_FILE=None,
+                                   dont_save_on_del=True,
+                                   ipv6_aggregation=64)
+            self.assertEqual(len(cache.IPAddressesCache), 3)
+            for ip in self.IPS:
+                res = cache.GetIPInformation(ip)
+                self.assertEqual(res["ASN"], "3333")
+                self.assertEqual(res["HostName"], "")
+            self.verify_fetchipinfo_calls(2)
+
+            cache = IPDetailsCache(IP_ADDRESSES_CACHE_FILE=addr_file,
+                                   IP_PREFIXES_CACHE_FILE=None,
+                                   dont_save_on_del=True,
+                                   ipv6_prefix_only=True)
+            self.assertEqual(len(cache.IPAddressesCache), 1)
+        finally:
+            shutil.rmtree(dir)
+
+    def test_invalid_aggregation(self):
+        """IPv6 aggregation, invalid value"""
+        with self.assertRaises(ValueError):
+            self.get_cache(ipv6_aggregation=129)
+
+    def test_aggregation_fields(self):
+        """IPv6 aggregation, fields not requested"""
+        cache = self.get_cache(ipv6_aggregation=64)
+        res = cache.GetIPInformation(self.IPS[1], fields=["ASN", "IsIXP"])
+        self.assertEqual(res["HostName"], "")
+
+        res = cache.GetIPInformation(self.IPS[1])
+        self.assertEqual(res["HostName"], "")
+        res = cache.GetIPInformation(self.IPS[2])
+        self.assertEqual(res["HostName"], "")
+        self.assertEqual(self.mock_getfqdn.call_count, 0)
+
+        # entries added without HostName before
+        key = list(cache.IPAddressesCache.keys())[0]
+        cache.IPAddressesCache[key] = \
+            cache.IPAddressesCache[key]._replace(HostName=None)
+        res = cache.GetIPInformation(self.IPS[0])
+        self.assertEqual(res["HostName"], "")
+        self.assertEqual(cache.IPAddressesCache[key]["HostName"], "")
+        self.assertEqual(self.mock_getfqdn.call_count, 0)
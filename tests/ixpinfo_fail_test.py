@@ -87,12 +87,23 @@ class TestIXPInfoFail(TestIPDetailsCacheBase):
             {"data": [{}]}
         ), "ixpfxs - missing key from elements: ixlan_id")
 
+    def test_ixps_failure6(self):
+        """IXPs info failure, missing elements attribute, id"""
+
+        self.simulate_failure((
+            {"data": [
+                {"prefix": "", "ixlan_id": ""}]
+            },
+            {"data": [{}]},
+            {"data": [{}]}
+        ), "ixpfxs - missing key from elements: id")
+
     def test_ixps_failure_ok(self):
         """IXPs info failure, everything ok"""
 
         self.simulate_failure((
             {"data": [
-                {"prefix": "", "ixlan_id": ""}]
+                {"prefix": "", "ixlan_id": "", "id": ""}]
             },
             {"data": [
                 {"id": "", "ix_id": ""}]
@@ -0,0 +1,132 @@
+import json
+import mock
+import os
+import shutil
+import tempfile
+import threading
+from time import time
+
+
+from base_class import TestIPDetailsCacheBase
+from pierky.ipdetailscache import IPDetailsCache, IPDetailsCacheError
+
+
+class TestLazyLoad(TestIPDetailsCacheBase):
+    LIVE = False
+
+    def setUp(self):
+        TestIPDetailsCacheBase.setUp(self)
+
+        self.dir = tempfile.mkdtemp()
+        self.addr_file = os.path.join(self.dir, "ip_addr.cache")
+        self.pref_file = os.path.join(self.dir, "ip_pref.cache")
+
+        self.ts = int(time()) - 60
+        with open(self.addr_file, "w") as f:
+            json.dump({self.IP: {"TS": self.ts, "ASN": self.ASN,
+                                 "Holder": self.HOLDER, "Prefix": self.PREFIX,
+                                 "HostName": "unknown", "IsIXP": None,
+                                 "IXPName": ""}}, f)
+        with open(self.pref_file, "w") as f:
+            json.dump({self.PREFIX: {"TS": self.ts, "ASN": self.ASN,
+                                     "Holder": self.HOLDER}}, f)
+
+    def tearDown(self):
+        TestIPDetailsCacheBase.tearDown(self)
+        shutil.rmtree(self.dir)
+
+    def get_cache(self, **kwargs):
+        return IPDetailsCache(IP_ADDRESSES_CACHE_FILE=self.addr_file,
+                              IP_PREFIXES_CACHE_FILE=self.pref_file,
+                              dont_save_on_del=True, lazy_load=True,
+                              **kwargs)
+
+    def test_lazy_load(self):
+        """Lazy load, lookups after the cache is ready"""
+        cache = self.get_cache()
+        self.assertTrue(cache.WaitCacheReady(5))
+        self.assertTrue(cache.IsCacheReady())
+
+        ip = cache.GetIPInformation(self.IP)
+        self.assertEqual(ip["ASN"], self.ASN)
+        self.assertEqual(ip["TS"], self.ts)
+        ip = cache.GetIPInformation(self.SAME_PREFIX_IP)
+        self.assertEqual(ip["Prefix"], self.PREFIX)
+        self.verify_fetchipinfo_calls(0)
+
+    def test_lazy_load_lookup_before_ready(self):
+        """Lazy load, lookups before the cache is ready"""
+        release = threading.Event()
+        load_json_file = IPDetailsCache._load_json_file
+
+        def blocking_load_json_file(self, path, descr):
+            release.wait(5)
+            return load_json_file(self, path, descr)
+
+        mock.patch.object(IPDetailsCache, "_load_json_file",
+                          blocking_load_json_file).start()
+
+        cache = self.get_cache()
+        self.assertFalse(cache.IsCacheReady())
+
+        # falls through to the fetch path
+        ip = cache.GetIPInformation(self.IP)
+        self.assertEqual(ip["ASN"], self.ASN)
+        self.verify_fetchipinfo_calls(1)
+
+        release.set()
+        self.assertTrue(cache.WaitCacheReady(5))
+
+        # the fresher entry is not overwritten by the loaded one
+        self.assertEqual(cache.GetIPInformation(self.IP)["TS"], ip["TS"])
+        self.assertGreater(ip["TS"], self.ts)
+        self.verify_fetchipinfo_calls(1)
+
+    def test_lazy_load_wait_for_prefixes(self):
+        """Lazy load, lookups wait for the prefixes cache"""
+        cache = self.get_cache(lazy_load_timeout=5)
+        ip = cache.GetIPInformation(self.SAME_PREFIX_IP)
+        self.assertEqual(ip["Prefix"], self.PREFIX)
+        self.verify_fetchipinfo_calls(0)
+
+    def test_lazy_load_error(self):
+        """Lazy load, loading error"""
+        with open(self.pref_file, "w") as f:
+            f.write("not json")
+
+        cache = self.get_cache()
+        with self.assertRaises(IPDetailsCacheError):
+            cache.WaitCacheReady(5)
+        self.assertFalse(cache.IsCacheReady())
+
+        with self.assertRaises(IPDetailsCacheError):
+            cache.SaveCache()
+
+    def test_lazy_load_parser(self):
+        """Lazy load, cache files parsed one item at a time"""
+        cache = self.get_cache()
+        cache.WaitCacheReady(5)
+        path = os.path.join(self.dir, "test.json")
+
+        data = {"a": {"x": [1, {"}": "{"}]}, "b\"": None, "c": "d"}
+        for text in [json.dumps(data), json.dumps(data, indent=2),
+                     " {} ", "{\n}"]:
+            with open(path, "w") as f:
+                f.write(text)
+            self.assertEqual(dict(cache._iter_json_file(path, "test")),
+                             json.loads(text))
+
+        # items are yielded before the whole file is parsed
+        with open(path, "w") as f:
+            f.write('{"a": 1, "b": [')
+        items = cache._iter_json_file(path, "test")
+        self.assertEqual(next(items), ("a", 1))
+        with self.assertRaises(ValueError):
+            next(items)
+
+        for text in ["[]", '{"a": 1} x', '{"a" 1}', '{"a": 1 "b": 2}',
+                     "{1: 2}"]:
+            with open(path, "w") as f:
+                f.write(text)
+            with self.assertRaises(ValueError):
+                list(cache._iter_json_file(path, "test"))
@@ -161,8 +161,7 @@ class TestIPDetailsCache(TestIPDetailsCacheBaseTests):
 
         # Invalidate addresses cache and verify if IP address info
         # obtained from prefixes cache contain the IXP info
-        for k in self.cache.IPAddressesCache.keys():
-            self.cache.IPAddressesCache[k]["TS"] = 0
+        self.expire_addresses()
 
         ip = self.cache.GetIPInformation(self.IXPS_NOT_ANNOUNCED_IP)
 
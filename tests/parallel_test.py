@@ -0,0 +1,160 @@
+import mock
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+from base_class import TestIPDetailsCacheBase
+from pierky.ipdetailscache import IPDetailsCache, IPDetailsCacheError
+from pierky.ipdetailscache.parallel import ParallelEnricher
+from pierky.ipdetailscache.ratelimit import RateLimiter
+
+FETCHES = multiprocessing.Value("i", 0)
+
+
+class MockedIPDetailsCache(IPDetailsCache):
+
+    def FetchIPInfo(self, IP):
+        with FETCHES.get_lock():
+            FETCHES.value += 1
+        return TestIPDetailsCacheBase.MOCK_RESULTS[IP]
+
+
+def acquire_many(limiter, num):
+    for _ in range(num):
+        limiter.acquire()
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_rate(self):
+        """Rate limiter, rate enforced"""
+        limiter = RateLimiter(20)
+        start = time.time()
+        acquire_many(limiter, 10)
+        self.assertGreaterEqual(time.time() - start, 0.4)
+
+    def test_burst(self):
+        """Rate limiter, burst"""
+        limiter = RateLimiter(1, burst=5)
+        start = time.time()
+        acquire_many(limiter, 5)
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_shared(self):
+        """Rate limiter, budget shared among processes"""
+        limiter = RateLimiter(20, shared=True)
+        processes = [multiprocessing.Process(target=acquire_many,
+                                             args=(limiter, 5))
+                     for _ in range(2)]
+        start = time.time()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertGreaterEqual(time.time() - start, 0.4)
+
+
+class TestParallelEnricher(TestIPDetailsCacheBase):
+    LIVE = False
+
+    IPS = [TestIPDetailsCacheBase.IP,
+           TestIPDetailsCacheBase.SAME_PREFIX_IP,
+           TestIPDetailsCacheBase.SAME_AS_DIFFERENT_PREFIX_IP,
+           TestIPDetailsCacheBase.NOT_ANNOUNCED_IP,
+           "127.0.0.1"] * 50
+
+    def setUp(self):
+        TestIPDetailsCacheBase.setUp(self)
+        mock.patch("socket.getfqdn", side_effect=lambda ip: ip).start()
+        FETCHES.value = 0
+
+        self.dir = tempfile.mkdtemp()
+        self.main = MockedIPDetailsCache(
+            IP_ADDRESSES_CACHE_FILE=os.path.join(self.dir, "ip_addr.cache"),
+            IP_PREFIXES_CACHE_FILE=os.path.join(self.dir, "ip_pref.cache"),
+            dont_save_on_del=True
+        )
+
+    def tearDown(self):
+        TestIPDetailsCacheBase.tearDown(self)
+        shutil.rmtree(self.dir)
+
+    def test_ordered(self):
+        """Parallel enrichment, ordered results"""
+        enricher = ParallelEnricher(self.main, workers=4, batch_size=7)
+        results = list(enricher.Enrich(self.IPS))
+
+        self.assertEqual([IP for IP, _ in results], self.IPS)
+        for IP, result in results:
+            if IP == "127.0.0.1":
+                self.assertEqual(result["ASN"], "unknown")
+            elif IP == self.NOT_ANNOUNCED_IP:
+                self.assertEqual(result["ASN"], "not announced")
+            else:
+                self.assertEqual(result["ASN"], self.ASN)
+
+        # Each prefix has been fetched by one worker only.
+        self.assertEqual(FETCHES.value, 3)
+
+    def test_ordered_streaming(self):
+        """Parallel enrichment, ordered results with a rare shard"""
+        first_result = threading.Event()
+        waited = []
+
+        def IPs():
+            # 127.0.0.1 and 10.1.0.1 belong to different shards
+            yield "127.0.0.1"
+            for _ in range(200):
+                yield "10.1.0.1"
+            waited.append(first_result.wait(5))
+            for _ in range(200):
+                yield "10.1.0.1"
+
+        enricher = ParallelEnricher(self.main, workers=2, batch_size=7)
+        results = []
+        for IP, result in enricher.Enrich(IPs()):
+            first_result.set()
+            results.append(IP)
+
+        self.assertEqual(waited, [True])
+        self.assertEqual(results, ["127.0.0.1"] + ["10.1.0.1"] * 400)
+
+    def test_unordered(self):
+        """Parallel enrichment, unordered results"""
+        enricher = ParallelEnricher(self.main, workers=3, ordered=False,
+                                    batch_size=5)
+        results = list(enricher.Enrich(self.IPS))
+
+        self.assertEqual(sorted(IP for IP, _ in results), sorted(self.IPS))
+
+    def test_merge(self):
+        """Parallel enrichment, new entries merged into the main cache"""
+        list(ParallelEnricher(self.main, workers=2).Enrich(self.IPS))
+
+        self.assertEqual(len(self.main.IPAddressesCache), 4)
+        self.assertEqual(sorted(self.main.IPPrefixesCache.keys()),
+                         sorted([self.PREFIX, "193.0.22.0/23",
+                                 self.NOT_ANNOUNCED_IP]))
+        self.assertFalse(self.main.IsCacheDirty())
+
+        # A new run is answered by the seeded workers' caches.
+        FETCHES.value = 0
+        list(ParallelEnricher(self.main, workers=2).Enrich(self.IPS))
+        self.assertEqual(FETCHES.value, 0)
+
+    def test_invalid_address(self):
+        """Parallel enrichment, invalid address"""
+        enricher = ParallelEnricher(self.main, workers=2)
+        with self.assertRaises(ValueError):
+            list(enricher.Enrich([self.IP, "foo"]))
+
+    def test_worker_error(self):
+        """Parallel enrichment, error in worker"""
+        enricher = ParallelEnricher(self.main, workers=2)
+        with self.assertRaises(IPDetailsCacheError):
+            list(enricher.Enrich(["8.8.8.8"]))
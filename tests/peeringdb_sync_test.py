@@ -0,0 +1,241 @@
+import json
+import mock
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from urlparse import parse_qs, urlparse
+
+
+from base_class import TestIPDetailsCacheBase
+from pierky.ipdetailscache import IPDetailsCache, \
+                                  IPDetailsCacheIXPInformationError
+
+
+class PeeringDBStandIn(object):
+    """A local stand-in for the PeeringDB API.
+
+    Each object carries an "updated" counter; "since" queries return the
+    objects updated after the given value, deleted ones included. The
+    ETag of each table is its last update counter."""
+
+    def __init__(self):
+        self.clock = 1
+        self.tables = {"ixpfx": {}, "ixlan": {}, "ix": {}}
+        self.requests = []
+        self.not_modified = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def set(self, table, key, **obj):
+        self.clock += 1
+        obj["status"] = "ok"
+        obj["updated"] = self.clock
+        self.tables[table][key] = obj
+
+    def delete(self, table, key):
+        self.clock += 1
+        self.tables[table][key]["status"] = "deleted"
+        self.tables[table][key]["updated"] = self.clock
+
+    def etag(self, table):
+        return '"{}"'.format(
+            max([0] + [o["updated"] for o in self.tables[table].values()])
+        )
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.release.wait(5)
+
+                url = urlparse(self.path)
+                table = url.path.split("/")[-1]
+                since = parse_qs(url.query).get("since")
+                server.requests.append(
+                    (table, since, self.headers.get("If-None-Match"))
+                )
+
+                etag = server.etag(table)
+                if self.headers.get("If-None-Match") == etag:
+                    server.not_modified += 1
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+
+                if since:
+                    # here "since" is the value of the update counter
+                    objs = [o for o in server.tables[table].values()
+                            if o["updated"] > server.since_counter]
+                else:
+                    objs = [o for o in server.tables[table].values()
+                            if o["status"] == "ok"]
+
+                body = json.dumps({"data": objs}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+class TestPeeringDBSync(TestIPDetailsCacheBase):
+    LIVE = False
+
+    def setUp(self):
+        TestIPDetailsCacheBase.setUp(self)
+
+        self.dir = tempfile.mkdtemp()
+        self.ixps_file = os.path.join(self.dir, "ixps.cache")
+
+        self.pdb = PeeringDBStandIn()
+        self.pdb.set("ix", "1", id=1, name="DE-CIX Hamburg")
+        self.pdb.set("ix", "2", id=2, name="AMS-IX")
+        self.pdb.set("ixlan", "10", id=10, ix_id=1)
+        self.pdb.set("ixlan", "20", id=20, ix_id=2)
+        self.pdb.set("ixpfx", "100", id=100,
+                     prefix="80.81.202.0/23", ixlan_id=10)
+        self.pdb.set("ixpfx", "200", id=200,
+                     prefix="80.249.208.0/21", ixlan_id=20)
+        self.pdb.since_counter = self.pdb.clock
+
+        self.server = HTTPServer(("127.0.0.1", 0), self.pdb.handler())
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+        base_url = "http://127.0.0.1:{}/api/".format(self.server.server_port)
+        for table in ["ixpfx", "ixlan", "ix"]:
+            mock.patch.object(IPDetailsCache, "PEERINGDB_API_" + table,
+                              base_url + table).start()
+
+    def tearDown(self):
+        self.pdb.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+        TestIPDetailsCacheBase.tearDown(self)
+        shutil.rmtree(self.dir)
+
+    def sync(self, cache=None, **kwargs):
+        cache = cache or self.cache
+        cache.UseIXPs(WhenUse=2, IXP_CACHE_FILE=self.ixps_file,
+                      MAX_CACHE=-1, **kwargs)
+        return cache
+
+    def ixps(self, cache=None):
+        return (cache or self.cache).IXPsCache["Data"]
+
+    def test_full_sync(self):
+        """PeeringDB sync, first full sync"""
+        self.sync()
+
+        self.assertEqual(self.ixps(), {
+            "80.81.202.0/23": {"name": "DE-CIX Hamburg"},
+            "80.249.208.0/21": {"name": "AMS-IX"}
+        })
+        for table, since, etag in self.pdb.requests:
+            self.assertIsNone(since)
+            self.assertIsNone(etag)
+
+        ip = self.cache.GetIPInformation(self.IXPS_NOT_ANNOUNCED_IP)
+        self.assertEqual(ip["IXPName"], self.IXPS_NOT_ANNOUNCED_IP_IXPNAME)
+
+    def test_incremental_sync(self):
+        """PeeringDB sync, only changes are applied"""
+        self.sync()
+        self.pdb.requests = []
+
+        self.pdb.set("ix", "2", id=2, name="AMS-IX Amsterdam")
+        self.pdb.delete("ixpfx", "100")
+        self.pdb.set("ixpfx", "201", id=201,
+                     prefix="2001:7f8:1::/64", ixlan_id=20)
+
+        # a new cache object, loading the state from the IXPs cache file
+        cache = IPDetailsCache(IP_ADDRESSES_CACHE_FILE=None,
+                               IP_PREFIXES_CACHE_FILE=None)
+        self.sync(cache)
+
+        self.assertEqual(self.ixps(cache), {
+            "80.249.208.0/21": {"name": "AMS-IX Amsterdam"},
+            "2001:7f8:1::/64": {"name": "AMS-IX Amsterdam"}
+        })
+        self.assertEqual(len(self.pdb.requests), 3)
+        for table, since, etag in self.pdb.requests:
+            self.assertIsNotNone(since)
+            self.assertIsNotNone(etag)
+
+    def test_prefix_changed(self):
+        """PeeringDB sync, prefix of an IXP prefix object changed"""
+        self.sync()
+
+        self.pdb.set("ixpfx", "100", id=100, prefix="80.81.200.0/23",
+                     ixlan_id=10)
+        self.sync()
+
+        self.assertEqual(self.ixps(), {
+            "80.81.200.0/23": {"name": "DE-CIX Hamburg"},
+            "80.249.208.0/21": {"name": "AMS-IX"}
+        })
+
+    def test_lookup_during_refresh(self):
+        """PeeringDB sync, IXPs info replaced during a lookup"""
+        self.sync()
+        index = self.cache._get_ixps_index()
+
+        # the refreshed table doesn't have the prefix found in the index
+        self.cache.IXPsCache = dict(self.cache.IXPsCache, Data={})
+        self.cache._ixps_index_data = self.cache.IXPsCache["Data"]
+        self.cache._ixps_index = index
+
+        ip = self.cache.GetIPInformation(self.IXPS_NOT_ANNOUNCED_IP)
+        self.assertEqual(ip["IXPName"], self.IXPS_NOT_ANNOUNCED_IP_IXPNAME)
+
+    def test_not_modified(self):
+        """PeeringDB sync, conditional requests"""
+        self.sync()
+        data = self.ixps()
+        self.pdb.requests = []
+
+        self.sync()
+
+        self.assertEqual(len(self.pdb.requests), 3)
+        self.assertEqual(self.pdb.not_modified, 3)
+        self.assertEqual(self.ixps(), data)
+
+    def test_background_sync(self):
+        """PeeringDB sync, background refresh"""
+        self.sync()
+        self.pdb.release.clear()
+        self.pdb.set("ix", "1", id=1, name="DE-CIX HH")
+
+        self.sync(background=True)
+        self.assertFalse(self.cache.WaitIXPsRefresh(0.1))
+
+        # the old table keeps serving lookups
+        ip = self.cache.GetIPInformation(self.IXPS_NOT_ANNOUNCED_IP)
+        self.assertEqual(ip["IXPName"], self.IXPS_NOT_ANNOUNCED_IP_IXPNAME)
+
+        self.pdb.release.set()
+        self.assertTrue(self.cache.WaitIXPsRefresh(5))
+        self.assertEqual(self.ixps()["80.81.202.0/23"]["name"], "DE-CIX HH")
+
+    def test_background_sync_error(self):
+        """PeeringDB sync, background refresh error"""
+        self.server.shutdown()
+        self.server.server_close()
+
+        self.sync(background=True)
+        with self.assertRaises(IPDetailsCacheIXPInformationError):
+            self.cache.WaitIXPsRefresh(5)
@@ -0,0 +1,136 @@
+import json
+import mock
+import os
+import pickle
+import shutil
+import tempfile
+from time import time
+
+
+from base_class import TestIPDetailsCacheBase
+from pierky.ipdetailscache import IPDetailsCache
+from pierky.ipdetailscache.records import IPInformation
+
+
+class TestRecords(TestIPDetailsCacheBase):
+    LIVE = False
+
+    def setUp(self):
+        TestIPDetailsCacheBase.setUp(self)
+        self.mock_getfqdn = mock.patch(
+            "socket.getfqdn", return_value="host.example.com"
+        ).start()
+
+    def test_immutable(self):
+        """Records, results can't be modified"""
+        res = self.cache.GetIPInformation(self.IP)
+        with self.assertRaises(AttributeError):
+            res.ASN = "1"
+        with self.assertRaises(TypeError):
+            res["ASN"] = "1"
+
+    def test_mapping(self):
+        """Records, mapping-compatible access"""
+        res = self.cache.GetIPInformation(self.IP)
+        self.assertEqual(res["ASN"], self.ASN)
+        self.assertEqual(res.ASN, self.ASN)
+        self.assertEqual(res.get("Prefix"), self.PREFIX)
+        self.assertEqual(sorted(res.keys()), sorted(res._asdict().keys()))
+        self.assertEqual(dict(res), res._asdict())
+        self.assertEqual(res, res._asdict())
+        self.assertNotIn("keys", res)
+        with self.assertRaises(KeyError):
+            res["keys"]
+
+    def test_pickle(self):
+        """Records, pickling"""
+        res = self.cache.GetIPInformation(self.IP)
+        self.assertEqual(pickle.loads(pickle.dumps(res)), res)
+
+    def test_shared_record(self):
+        """Records, cache hits return the cached record"""
+        res1 = self.cache.GetIPInformation(self.IP)
+        res2 = self.cache.GetIPInformation(self.IP)
+        self.assertIs(res1, res2)
+        self.verify_fetchipinfo_calls(1)
+
+        self.expire_addresses()
+        res3 = self.cache.GetIPInformation(self.IP)
+        self.assertIsNot(res3, res1)
+        self.assertEqual(res3["ASN"], self.ASN)
+
+    def test_not_routable(self):
+        """Records, not globally routable addresses"""
+        res = self.cache.GetIPInformation("192.168.0.1")
+        self.assertEqual(res["ASN"], "unknown")
+        self.assertIs(res, self.cache.GetIPInformation("10.0.0.1"))
+        self.verify_fetchipinfo_calls(0)
+
+    def test_save_load(self):
+        """Records, saved and loaded"""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            addr_file = os.path.join(tmp_dir, "ip_addr.cache")
+            pref_file = os.path.join(tmp_dir, "ip_pref.cache")
+
+            cache = IPDetailsCache(IP_ADDRESSES_CACHE_FILE=addr_file,
+                                   IP_PREFIXES_CACHE_FILE=pref_file)
+            res = cache.GetIPInformation(self.IP)
+            cache.SaveCache()
+
+            with open(addr_file) as f:
+                self.assertEqual(json.load(f), {self.IP: res._asdict()})
+
+            cache = IPDetailsCache(IP_ADDRESSES_CACHE_FILE=addr_file,
+                                   IP_PREFIXES_CACHE_FILE=pref_file,
+                                   dont_save_on_del=True)
+            loaded = cache.GetIPInformation(self.IP)
+            self.assertIsInstance(loaded, IPInformation)
+            self.assertEqual(loaded, res)
+            self.verify_fetchipinfo_calls(1)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_merge_dicts(self):
+        """Records, entries merged from dicts"""
+        entry = {"TS": int(time()), "ASN": "1", "Holder": "", "Prefix": "",
+                 "HostName": "", "IsIXP": False, "IXPName": ""}
+        self.cache.MergeCache({"193.0.6.9": entry}, {})
+        res = self.cache.GetIPInformation("193.0.6.9")
+        self.assertIsInstance(res, IPInformation)
+        self.assertEqual(res, entry)
+
+
+class TestHitPathBenchmark(TestIPDetailsCacheBase):
+    LIVE = False
+
+    ADDRESSES = 1000
+    ROUNDS = 100
+
+    # Conservative lower bound: hits are expected to be much faster.
+    MIN_HITS_PER_SECOND = 100000
+
+    def setUp(self):
+        TestIPDetailsCacheBase.setUp(self)
+        self.mock_fetchipinfo.side_effect = lambda self, ip: \
+            TestIPDetailsCacheBase.MOCK_RESULTS[TestIPDetailsCacheBase.IP]
+        mock.patch("socket.getfqdn", return_value="host.example.com").start()
+
+    def test_hits(self):
+        """Benchmark, address cache hits"""
+        IPs = ["193.0.{}.{}".format(i // 256, i % 256)
+               for i in range(self.ADDRESSES)]
+        first = [self.cache.GetIPInformation(IP) for IP in IPs]
+
+        start = time()
+        for _ in range(self.ROUNDS):
+            for IP in IPs:
+                self.cache.GetIPInformation(IP)
+        elapsed = time() - start
+
+        for IP, res in zip(IPs, first):
+            self.assertIs(self.cache.GetIPInformation(IP), res)
+        self.verify_fetchipinfo_calls(1)
+
+        hits_per_second = self.ADDRESSES * self.ROUNDS / elapsed
+        self.assertGreater(hits_per_second, self.MIN_HITS_PER_SECOND)
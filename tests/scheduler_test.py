@@ -0,0 +1,262 @@
+import mock
+import threading
+import time
+import unittest
+
+
+from base_class import TestIPDetailsCacheBase
+from pierky.ipdetailscache import IPDetailsCache, IPDetailsCacheError
+from pierky.ipdetailscache.scheduler import FetchScheduler
+
+
+class TestFetchScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = FetchScheduler(concurrency={"interactive": 1,
+                                                     "bulk": 1})
+        self.release = threading.Event()
+        self.calls = []
+
+    def tearDown(self):
+        self.release.set()
+        self.scheduler.close()
+
+    def blocked(self, name):
+        self.calls.append(name)
+        self.release.wait()
+        return name
+
+    def func(self, name):
+        self.calls.append(name)
+        return name
+
+    def test_lanes(self):
+        """Scheduler, interactive calls don't wait for bulk ones"""
+        bulk = [self.scheduler.submit(i, self.blocked, (i,), "bulk")
+                for i in range(10)]
+
+        call = self.scheduler.submit("x", self.func, ("x",))
+        self.assertTrue(call.wait(1))
+        self.assertEqual(call.result(), "x")
+        self.assertFalse(bulk[-1].wait(0))
+
+        stats = self.scheduler.stats()
+        self.assertEqual(stats["bulk"]["Running"], 1)
+        self.assertEqual(stats["bulk"]["Queued"], 9)
+        self.assertEqual(stats["interactive"]["Completed"], 1)
+
+        self.release.set()
+        for call in bulk:
+            self.assertTrue(call.wait(1))
+        self.assertEqual(self.scheduler.stats()["bulk"]["Completed"], 10)
+
+    def test_dedup(self):
+        """Scheduler, calls with the same key are deduplicated"""
+        call1 = self.scheduler.submit("x", self.blocked, ("x",), "bulk")
+        call2 = self.scheduler.submit("x", self.blocked, ("x",), "bulk")
+        self.assertIs(call1, call2)
+
+        self.release.set()
+        self.assertTrue(call1.wait(1))
+        self.assertEqual(self.calls, ["x"])
+        self.assertEqual(self.scheduler.stats()["bulk"]["Deduplicated"], 1)
+
+    def test_promotion(self):
+        """Scheduler, queued bulk calls promoted by interactive ones"""
+        self.scheduler.submit("busy", self.blocked, ("busy",), "bulk")
+        queued = self.scheduler.submit("x", self.func, ("x",), "bulk")
+
+        call = self.scheduler.submit("x", self.func, ("x",), "interactive")
+        self.assertIs(call, queued)
+        self.assertEqual(call.lane, "interactive")
+        self.assertTrue(call.wait(1))
+        self.assertEqual(self.calls.count("x"), 1)
+
+        stats = self.scheduler.stats()
+        self.assertEqual(stats["interactive"]["Promoted"], 1)
+        self.assertEqual(stats["bulk"]["Queued"], 0)
+
+        # the stale entry in the bulk queue is skipped
+        self.release.set()
+        call = self.scheduler.submit("y", self.func, ("y",), "bulk")
+        self.assertTrue(call.wait(1))
+        self.assertEqual(self.calls.count("x"), 1)
+
+    def test_close(self):
+        """Scheduler, queued calls fail when closed"""
+        self.scheduler.submit("busy", self.blocked, ("busy",), "bulk")
+        queued = self.scheduler.submit("x", self.func, ("x",), "bulk")
+        self.scheduler.close()
+
+        self.assertTrue(queued.wait(1))
+        with self.assertRaises(IPDetailsCacheError):
+            queued.result()
+        with self.assertRaises(IPDetailsCacheError):
+            self.scheduler.submit("y", self.func, ("y",))
+
+    def test_invalid(self):
+        """Scheduler, invalid arguments"""
+        with self.assertRaises(ValueError):
+            self.scheduler.submit("x", self.func, ("x",), "other")
+        with self.assertRaises(ValueError):
+            FetchScheduler(concurrency={"other": 1})
+        with self.assertRaises(ValueError):
+            FetchScheduler(shares={"bulk": 0})
+
+
+class TestCacheScheduler(TestIPDetailsCacheBase):
+    LIVE = False
+
+    def setUp(self):
+        TestIPDetailsCacheBase.setUp(self)
+        mock.patch("socket.getfqdn", return_value="host.example.com").start()
+
+        self.scheduler = FetchScheduler()
+        self.cache = IPDetailsCache(IP_ADDRESSES_CACHE_FILE=None,
+                                    IP_PREFIXES_CACHE_FILE=None,
+                                    scheduler=self.scheduler)
+
+    def tearDown(self):
+        self.scheduler.close()
+        TestIPDetailsCacheBase.tearDown(self)
+
+    def test_lane(self):
+        """Scheduler, lookups tagged with a lane"""
+        res = self.cache.GetIPInformation(self.IP, lane="bulk")
+        self.assertEqual(res["ASN"], self.ASN)
+        self.assertEqual(
+            self.cache.GetIPInformation(self.NOT_ANNOUNCED_IP)["ASN"],
+            "not announced"
+        )
+
+        stats = self.scheduler.stats()
+        self.assertEqual(stats["bulk"]["Completed"], 1)
+        self.assertEqual(stats["interactive"]["Completed"], 1)
+
+        with self.assertRaises(ValueError):
+            self.cache.GetIPInformation(self.SAME_AS_DIFFERENT_PREFIX_IP,
+                                        lane="other")
+
+    def test_prefix_dedup(self):
+        """Scheduler, fetches deduplicated by prefix"""
+        self.cache.GetIPInformation(self.IP)
+        self.expire_addresses()
+        self.cache.IPPrefixesCache[self.PREFIX] = \
+            dict(self.cache.IPPrefixesCache[self.PREFIX], TS=0)
+
+        def fetchipinfo(cache, ip):
+            time.sleep(0.2)
+            return TestIPDetailsCacheBase.MOCK_RESULTS[self.IP]
+        self.mock_fetchipinfo.side_effect = fetchipinfo
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda ip, lane: results.append(
+                    self.cache.GetIPInformation(ip, lane=lane)
+                ),
+                args=(ip, lane)
+            )
+            for ip, lane in [(self.IP, "bulk"),
+                             (self.SAME_PREFIX_IP, "interactive")]
+        ]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+
+        self.verify_fetchipinfo_calls(2)
+        self.assertEqual(self.scheduler.stats()["interactive"]["Deduplicated"],
+                         1)
+        self.assertEqual([res["Prefix"] for res in results],
+                         [self.PREFIX, self.PREFIX])
+
+    def test_prefix_split(self):
+        """Scheduler, stale prefix not announced as a whole anymore"""
+        self.cache.GetIPInformation(self.IP)
+        self.expire_addresses()
+        self.cache.IPPrefixesCache[self.PREFIX] = \
+            dict(self.cache.IPPrefixesCache[self.PREFIX], TS=0)
+
+        threads = []
+
+        def fetchipinfo(cache, ip):
+            threads.append(threading.current_thread().name)
+            time.sleep(0.2)
+            return {"status": "ok",
+                    "data": {"resource": "{}/31".format(ip),
+                             "asns": [{"asn": 1, "holder": ""}]}}
+        self.mock_fetchipinfo.side_effect = fetchipinfo
+
+        results = {}
+        lookups = [
+            threading.Thread(
+                target=lambda ip: results.__setitem__(
+                    ip, self.cache.GetIPInformation(ip, lane="bulk")
+                ),
+                args=(ip,)
+            )
+            for ip in [self.IP, self.SAME_PREFIX_IP]
+        ]
+        for thread in lookups:
+            thread.start()
+            time.sleep(0.05)
+        for thread in lookups:
+            thread.join()
+
+        self.assertEqual(results[self.IP]["Prefix"], "193.0.6.1/31")
+        self.assertEqual(results[self.SAME_PREFIX_IP]["Prefix"],
+                         "193.0.6.2/31")
+        self.assertEqual(threads, ["IPDetailsCache bulk fetches"] * 2)
+        self.assertEqual(self.scheduler.stats()["bulk"]["Completed"], 2)
+
+
+class TestLaneWithoutScheduler(TestIPDetailsCacheBase):
+    LIVE = False
+
+    def test_lane(self):
+        """Scheduler, lanes without a scheduler"""
+        mock.patch("socket.getfqdn", return_value="host.example.com").start()
+        res = self.cache.GetIPInformation(self.IP, lane="bulk")
+        self.assertEqual(res["ASN"], self.ASN)
+        with self.assertRaises(ValueError):
+            self.cache.GetIPInformation(self.IP, lane="other")
+
+
+class TestSharedScheduler(TestIPDetailsCacheBase):
+    LIVE = False
+
+    def test_shared(self):
+        """Scheduler, shared by two caches"""
+        mock.patch("socket.getfqdn", return_value="host.example.com").start()
+
+        def fetchipinfo(cache, ip):
+            time.sleep(0.2)
+            return TestIPDetailsCacheBase.MOCK_RESULTS[self.IP]
+        self.mock_fetchipinfo.side_effect = fetchipinfo
+
+        with FetchScheduler() as scheduler:
+            caches = [IPDetailsCache(IP_ADDRESSES_CACHE_FILE=None,
+                                     IP_PREFIXES_CACHE_FILE=None,
+                                     scheduler=scheduler)
+                      for _ in range(2)]
+            for cache in caches:
+                cache.IPPrefixesCache[self.PREFIX] = {
+                    "TS": 0, "ASN": self.ASN, "Holder": self.HOLDER
+                }
+                cache._rebuild_prefixes_index()
+
+            threads = [
+                threading.Thread(target=cache.GetIPInformation,
+                                 args=(self.IP,))
+                for cache in caches
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.verify_fetchipinfo_calls(2)
+        for cache in caches:
+            self.assertNotEqual(cache.IPPrefixesCache[self.PREFIX]["TS"], 0)
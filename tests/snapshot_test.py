@@ -0,0 +1,103 @@
+import gzip
+import json
+import mock
+import os
+import shutil
+import tempfile
+from time import time
+
+
+from base_class import TestIPDetailsCacheBase
+from pierky.ipdetailscache import IPDetailsCache, IPDetailsCacheError
+
+
+class TestSnapshot(TestIPDetailsCacheBase):
+    LIVE = False
+
+    def setUp(self):
+        TestIPDetailsCacheBase.setUp(self)
+        mock.patch("socket.getfqdn", return_value="host.example.com").start()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "snapshot.gz")
+
+    def tearDown(self):
+        TestIPDetailsCacheBase.tearDown(self)
+        shutil.rmtree(self.tmp_dir)
+
+    def new_cache(self):
+        return IPDetailsCache(IP_ADDRESSES_CACHE_FILE=None,
+                              IP_PREFIXES_CACHE_FILE=None)
+
+    def test_export_import(self):
+        """Snapshot, prefixes exported and imported"""
+        self.cache.GetIPInformation(self.IP)
+        self.cache.GetIPInformation(self.SAME_AS_DIFFERENT_PREFIX_IP)
+        self.assertEqual(self.cache.ExportSnapshot(self.path), (0, 2))
+
+        cache = self.new_cache()
+        self.assertEqual(cache.ImportSnapshot(self.path), (0, 2))
+        self.assertTrue(cache.IsCacheDirty())
+        self.assertEqual(cache.IPPrefixesCache, self.cache.IPPrefixesCache)
+
+        res = cache.GetIPInformation(self.SAME_PREFIX_IP)
+        self.assertEqual(res["ASN"], self.ASN)
+        self.assertEqual(res["Prefix"], self.PREFIX)
+        self.verify_fetchipinfo_calls(2)
+
+    def test_addresses(self):
+        """Snapshot, addresses"""
+        orig = self.cache.GetIPInformation(self.IP)
+        self.assertEqual(
+            self.cache.ExportSnapshot(self.path, include_addresses=True),
+            (1, 1)
+        )
+
+        cache = self.new_cache()
+        cache.ImportSnapshot(self.path)
+        self.assertEqual(cache.GetIPInformation(self.IP), orig)
+        self.verify_fetchipinfo_calls(1)
+
+    def test_since(self):
+        """Snapshot, entries older than since are not exported"""
+        self.cache.GetIPInformation(self.IP)
+        self.cache.IPPrefixesCache[self.PREFIX] = dict(
+            self.cache.IPPrefixesCache[self.PREFIX], TS=100
+        )
+        self.cache.GetIPInformation(self.SAME_AS_DIFFERENT_PREFIX_IP)
+        self.assertEqual(
+            self.cache.ExportSnapshot(self.path, since=int(time()) - 60,
+                                      include_addresses=True),
+            (2, 1)
+        )
+
+    def test_newest_wins(self):
+        """Snapshot, newest TS wins"""
+        self.cache.GetIPInformation(self.IP)
+        self.cache.ExportSnapshot(self.path)
+
+        cache = self.new_cache()
+        cache.IPPrefixesCache[self.PREFIX] = {
+            "TS": int(time()) + 100, "ASN": "1", "Holder": ""
+        }
+        cache.ImportSnapshot(self.path)
+        self.assertEqual(cache.IPPrefixesCache[self.PREFIX]["ASN"], "1")
+
+        cache.IPPrefixesCache[self.PREFIX]["TS"] = 0
+        cache.ImportSnapshot(self.path)
+        self.assertEqual(cache.IPPrefixesCache[self.PREFIX]["ASN"], self.ASN)
+
+    def test_invalid(self):
+        """Snapshot, invalid files"""
+        with self.assertRaises(IPDetailsCacheError):
+            self.cache.ImportSnapshot(self.path)
+
+        with open(self.path, "w") as f:
+            f.write("foo")
+        with self.assertRaises(IPDetailsCacheError):
+            self.cache.ImportSnapshot(self.path)
+
+        for data in [{}, {"Format": "ipdetailscache-snapshot", "Version": 99}]:
+            with gzip.open(self.path, "wb") as f:
+                f.write(json.dumps(data).encode("utf-8"))
+            with self.assertRaises(IPDetailsCacheError):
+                self.cache.ImportSnapshot(self.path)
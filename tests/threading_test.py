@@ -0,0 +1,114 @@
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+
+from base_class import TestIPDetailsCacheBase
+from pierky.ipdetailscache import IPDetailsCache
+
+
+def fake_fetchipinfo(latency):
+    # Simulates RIPEStat latency; every /24 is a different prefix.
+    def fetchipinfo(self, ip):
+        time.sleep(latency)
+        prefix = ".".join(ip.split(".")[:3]) + ".0/24"
+        return {"status": "ok",
+                "data": {"resource": prefix,
+                         "asns": [{"asn": 65000, "holder": "TEST"}]}}
+    return fetchipinfo
+
+
+class TestThreading(TestIPDetailsCacheBase):
+    LIVE = False
+
+    def setUp(self):
+        TestIPDetailsCacheBase.setUp(self)
+        self.mock_fetchipinfo.side_effect = fake_fetchipinfo(0.01)
+        mock.patch("socket.getfqdn", side_effect=lambda ip: ip).start()
+
+    def run_threads(self, num_threads, func, items):
+        chunks = [items[i::num_threads] for i in range(num_threads)]
+        errors = []
+
+        def worker(chunk):
+            try:
+                for item in chunk:
+                    func(item)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(chunk,))
+                   for chunk in chunks]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return time.time() - start
+
+    def test_misses_scale_with_threads(self):
+        """Threading, misses throughput scales with thread count"""
+        ips = ["193.{}.{}.1".format(i // 256, i % 256) for i in range(80)]
+
+        elapsed = {}
+        for num_threads in [1, 8]:
+            cache = IPDetailsCache(IP_ADDRESSES_CACHE_FILE=None,
+                                   IP_PREFIXES_CACHE_FILE=None)
+            elapsed[num_threads] = self.run_threads(
+                num_threads, cache.GetIPInformation, ips
+            )
+            self.assertEqual(len(cache.IPAddressesCache), len(ips))
+            self.assertEqual(len(cache.IPPrefixesCache), len(ips))
+
+        # No lock is held while fetching: 8 threads must be way faster.
+        self.assertLess(elapsed[8] * 3, elapsed[1])
+
+    def test_concurrent_hits_writes_and_saves(self):
+        """Threading, concurrent hits, misses and saves"""
+        dir = tempfile.mkdtemp()
+        try:
+            cache = IPDetailsCache(
+                IP_ADDRESSES_CACHE_FILE=os.path.join(dir, "ip_addr.cache"),
+                IP_PREFIXES_CACHE_FILE=os.path.join(dir, "ip_pref.cache"),
+                dont_save_on_del=True
+            )
+            self.mock_fetchipinfo.side_effect = fake_fetchipinfo(0)
+
+            hot = ["193.0.{}.1".format(i) for i in range(16)]
+            for ip in hot:
+                cache.GetIPInformation(ip)
+
+            stop = threading.Event()
+            errors = []
+
+            def saver():
+                try:
+                    while not stop.is_set():
+                        cache.SaveCache(force=True)
+                except Exception as e:
+                    errors.append(e)
+
+            saver_thread = threading.Thread(target=saver)
+            saver_thread.start()
+
+            def lookup(i):
+                res = cache.GetIPInformation(hot[i % len(hot)])
+                assert res["ASN"] == "65000", res
+                if i % 10 == 0:
+                    cache.GetIPInformation("194.{}.{}.1".format(i // 256,
+                                                               i % 256))
+
+            try:
+                self.run_threads(8, lookup, list(range(4000)))
+            finally:
+                stop.set()
+                saver_thread.join()
+
+            self.assertEqual(errors, [])
+            self.assertEqual(len(cache.IPAddressesCache), len(hot) + 400)
+        finally:
+            shutil.rmtree(dir)
@@ -0,0 +1,204 @@
+import json
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    from http.server import HTTPServer
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import HTTPServer
+    from urlparse import parse_qs, urlparse
+
+
+from base_class import TestIPDetailsCacheBase
+from peeringdb_sync_test import PeeringDBStandIn
+from pierky.ipdetailscache import IPDetailsCache, IPDetailsCacheError
+from pierky.ipdetailscache.transport import RecordingTransport, \
+                                            ReplayTransport, resource_key
+
+
+class TestTransport(TestIPDetailsCacheBase):
+    LIVE = False
+
+    def setUp(self):
+        TestIPDetailsCacheBase.setUp(self)
+        # FetchIPInfo is not mocked: responses come from the transports.
+        mock.patch.stopall()
+        mock.patch("socket.getfqdn", return_value="host.example.com").start()
+
+        self.dir = tempfile.mkdtemp()
+        self.archive = os.path.join(self.dir, "archive.gz")
+        self.requests = []
+
+    def tearDown(self):
+        TestIPDetailsCacheBase.tearDown(self)
+        shutil.rmtree(self.dir)
+
+    def ripestat(self, url, headers=None, timeout=None):
+        # A stand-in for RIPEStat, serving MOCK_RESULTS.
+        self.requests.append(url)
+        ip = parse_qs(urlparse(url).query)["resource"][0]
+        return 200, {"Content-Type": "application/json"}, \
+            json.dumps(self.MOCK_RESULTS[ip])
+
+    def new_cache(self, transport):
+        return IPDetailsCache(IP_ADDRESSES_CACHE_FILE=None,
+                              IP_PREFIXES_CACHE_FILE=None,
+                              transport=transport)
+
+    def lookup_all(self, cache):
+        return [dict(cache.GetIPInformation(ip))
+                for ip in [self.IP, self.SAME_PREFIX_IP,
+                           self.SAME_AS_DIFFERENT_PREFIX_IP,
+                           self.NOT_ANNOUNCED_IP]]
+
+    def test_record_replay(self):
+        """Transport, RIPEStat record and replay"""
+        with RecordingTransport(self.archive, opener=self.ripestat) as rec:
+            recorded = self.lookup_all(self.new_cache(rec))
+        self.assertEqual(len(self.requests), 3)
+
+        replay = ReplayTransport(self.archive)
+        self.assertEqual(len(replay), 3)
+        replayed = self.lookup_all(self.new_cache(replay))
+        self.assertEqual(len(self.requests), 3)
+
+        for res in recorded + replayed:
+            res.pop("TS")
+        self.assertEqual(replayed, recorded)
+        self.assertEqual(replayed[0]["ASN"], self.ASN)
+
+    def test_replay_order(self):
+        """Transport, responses of the same resource replayed in order"""
+        bodies = iter(["1", "2"])
+
+        def opener(url, headers=None, timeout=None):
+            return 200, {}, next(bodies)
+
+        with RecordingTransport(self.archive, opener=opener) as rec:
+            rec.open("http://localhost/api/ix?since=1")
+            rec.open("http://localhost/api/ix?since=2")
+
+        replay = ReplayTransport(self.archive)
+        self.assertEqual(
+            [replay.open("http://localhost/api/ix?since={}".format(i))[2]
+             for i in range(3)],
+            ["1", "2", "2"]
+        )
+
+    def test_resource_key(self):
+        """Transport, volatile parameters are not used as keys"""
+        self.assertEqual(resource_key("http://localhost/api/ix?since=123"),
+                         resource_key("http://localhost/api/ix"))
+        self.assertEqual(resource_key("http://localhost/a?x=1&y=2"),
+                         resource_key("http://localhost/a?y=2&x=1"))
+        self.assertNotEqual(resource_key("http://localhost/a?x=1"),
+                            resource_key("http://localhost/a?x=2"))
+
+    def test_errors(self):
+        """Transport, recorded errors and missing responses"""
+        def opener(url, headers=None, timeout=None):
+            raise IOError("connection refused")
+
+        with RecordingTransport(self.archive, opener=opener) as rec:
+            with self.assertRaises(IOError):
+                rec.open("http://localhost/a")
+
+        replay = ReplayTransport(self.archive)
+        with self.assertRaisesRegexp(IPDetailsCacheError,
+                                     "connection refused"):
+            replay.open("http://localhost/a")
+        with self.assertRaisesRegexp(IPDetailsCacheError,
+                                     "No recorded response"):
+            replay.open("http://localhost/b")
+
+        with self.assertRaises(IPDetailsCacheError):
+            self.new_cache(replay).GetIPInformation(self.IP)
+
+    def test_invalid_archive(self):
+        """Transport, invalid archive"""
+        with open(self.archive, "w") as f:
+            f.write("foo")
+        with self.assertRaises(IPDetailsCacheError):
+            ReplayTransport(self.archive)
+
+    def test_latency(self):
+        """Transport, simulated latency"""
+        def opener(url, headers=None, timeout=None):
+            time.sleep(0.1)
+            return 200, {}, "{}"
+
+        with RecordingTransport(self.archive, opener=opener) as rec:
+            rec.open("http://localhost/a")
+
+        for replay, min_delay, max_delay in [
+            (ReplayTransport(self.archive), 0, 0.05),
+            (ReplayTransport(self.archive, latency=0.2), 0.2, 1),
+            (ReplayTransport(self.archive, latency="recorded"), 0.1, 1)
+        ]:
+            start = time.time()
+            replay.open("http://localhost/a")
+            elapsed = time.time() - start
+            self.assertGreaterEqual(elapsed, min_delay)
+            self.assertLess(elapsed, max_delay)
+
+    def test_peeringdb(self):
+        """Transport, PeeringDB record and replay"""
+        pdb = PeeringDBStandIn()
+        pdb.set("ix", "1", id=1, name="DE-CIX Hamburg")
+        pdb.set("ixlan", "10", id=10, ix_id=1)
+        pdb.set("ixpfx", "100", id=100,
+                prefix="80.81.202.0/23", ixlan_id=10)
+
+        server = HTTPServer(("127.0.0.1", 0), pdb.handler())
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+        base_url = "http://127.0.0.1:{}/api/".format(server.server_port)
+        for table in ["ixpfx", "ixlan", "ix"]:
+            mock.patch.object(IPDetailsCache, "PEERINGDB_API_" + table,
+                              base_url + table).start()
+
+        try:
+            with RecordingTransport(self.archive) as rec:
+                cache = self.new_cache(rec)
+                cache.UseIXPs(WhenUse=2, IXP_CACHE_FILE=None)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(len(pdb.requests), 3)
+
+        cache = self.new_cache(ReplayTransport(self.archive))
+        cache.UseIXPs(WhenUse=2, IXP_CACHE_FILE=None)
+        self.assertEqual(cache.IXPsCache["Data"],
+                         {"80.81.202.0/23": {"name": "DE-CIX Hamburg"}})
+        self.assertEqual(len(pdb.requests), 3)
+        self.assertEqual(cache.IXPsCache["Sync"]["ix"]["etag"], pdb.etag("ix"))
+
+    def test_header_case(self):
+        """Transport, header names are case-insensitive"""
+        def opener(url, headers=None, timeout=None):
+            return 200, {"Etag": '"1"', "LAST-MODIFIED": "yesterday"}, \
+                json.dumps({"data": []})
+
+        with RecordingTransport(self.archive, opener=opener) as rec:
+            self.assertEqual(rec.open("http://localhost/api/ix")[1],
+                             {"etag": '"1"', "last-modified": "yesterday"})
+
+        def sync_with(transport):
+            sync = {}
+            self.new_cache(transport)._fetch_peeringdb_table(
+                "http://localhost/api/ix", sync
+            )
+            self.assertEqual(sync["etag"], '"1"')
+            self.assertEqual(sync["last_modified"], "yesterday")
+
+        sync_with(ReplayTransport(self.archive))
+        with RecordingTransport(os.path.join(self.dir, "other.gz"),
+                                opener=opener) as rec:
+            sync_with(rec)
@@ -0,0 +1,234 @@
+import copy
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from time import time
+
+
+from base_class import TestIPDetailsCacheBase
+from pierky.ipdetailscache import IPDetailsCache
+from pierky.ipdetailscache.ttl import AdaptiveTTLPolicy, FixedTTLPolicy
+
+
+class TestAdaptiveTTLPolicy(unittest.TestCase):
+
+    def entry(self, ASN="1", Prefix="193.0.0.0/21", **kwargs):
+        return dict(TS=0, ASN=ASN, Holder="", Prefix=Prefix, **kwargs)
+
+    def test_policy(self):
+        """TTL, adaptive policy"""
+        policy = AdaptiveTTLPolicy(min_ttl=10, initial_ttl=100, max_ttl=300)
+
+        new = self.entry()
+        self.assertEqual(policy.ttl(None, new), 100)
+        self.assertEqual(new["Stable"], 0)
+
+        old = self.entry(TTL=100, Stable=0)
+        new = self.entry()
+        self.assertEqual(policy.ttl(old, new), 200)
+        self.assertEqual(new["Stable"], 1)
+
+        self.assertEqual(policy.ttl(self.entry(TTL=200, Stable=1),
+                                    self.entry()), 300)
+
+        for new in [self.entry(ASN="2"), self.entry(Prefix="193.0.0.0/16")]:
+            self.assertEqual(policy.ttl(self.entry(TTL=300, Stable=5), new),
+                             10)
+            self.assertEqual(new["Stable"], 0)
+
+    def test_invalid(self):
+        """TTL, invalid adaptive policy"""
+        with self.assertRaises(ValueError):
+            AdaptiveTTLPolicy(min_ttl=100, initial_ttl=10)
+        with self.assertRaises(ValueError):
+            AdaptiveTTLPolicy(factor=0.5)
+
+
+class TestTTL(TestIPDetailsCacheBase):
+    LIVE = False
+
+    MAX_CACHE = 100
+
+    def setUp(self):
+        TestIPDetailsCacheBase.setUp(self)
+        mock.patch("socket.getfqdn", return_value="host.example.com").start()
+
+        self.results = copy.deepcopy(self.MOCK_RESULTS)
+        self.mock_fetchipinfo.side_effect = \
+            lambda cache, ip: self.results[ip]
+
+    def new_cache(self, policy, **kwargs):
+        return IPDetailsCache(IP_ADDRESSES_CACHE_FILE=None,
+                              IP_PREFIXES_CACHE_FILE=None,
+                              MAX_CACHE=self.MAX_CACHE, ttl_policy=policy,
+                              **kwargs)
+
+    def age(self, seconds):
+        # Make all the entries fetched seconds ago.
+        TS = int(time()) - seconds
+        for k, entry in list(self.cache.IPAddressesCache.items()):
+            self.cache.IPAddressesCache[k] = entry._replace(TS=TS)
+        for k, entry in list(self.cache.IPPrefixesCache.items()):
+            self.cache.IPPrefixesCache[k] = dict(entry, TS=TS)
+
+    def test_fixed(self):
+        """TTL, fixed policy"""
+        self.cache = self.new_cache(FixedTTLPolicy(1000))
+        res = self.cache.GetIPInformation(self.IP)
+        self.assertEqual(res.TTL, 1000)
+        self.assertNotIn("TTL", res)
+        self.assertEqual(self.cache.IPPrefixesCache[self.PREFIX]["TTL"], 1000)
+
+        self.age(500)
+        self.assertEqual(self.cache.GetIPInformation(self.IP)["ASN"],
+                         self.ASN)
+        self.assertEqual(
+            self.cache.GetIPInformation(self.SAME_PREFIX_IP)["ASN"], self.ASN
+        )
+        self.verify_fetchipinfo_calls(1)
+        self.assertEqual(self.cache.GetTTLStats()["SavedFetches"], 1)
+
+    def test_saved_fetches(self):
+        """TTL, saved fetches counted once per MAX_CACHE period"""
+        self.cache = self.new_cache(FixedTTLPolicy(1000))
+        now = time()
+        self.cache.GetIPInformation(self.IP)
+
+        with mock.patch("time.time", return_value=now + 150):
+            for _ in range(100):
+                self.cache.GetIPInformation(self.IP)
+                self.cache.GetIPInformation(self.SAME_PREFIX_IP)
+        self.assertEqual(self.cache.GetTTLStats()["SavedFetches"], 1)
+
+        with mock.patch("time.time", return_value=now + 250):
+            self.cache.GetIPInformation(self.IP)
+            self.cache.GetIPInformation(self.IP)
+        self.assertEqual(self.cache.GetTTLStats()["SavedFetches"], 2)
+
+        # still counted after the entry is refreshed
+        with mock.patch("time.time", return_value=now + 1100):
+            self.cache.GetIPInformation(self.IP)
+            self.cache.GetIPInformation(self.IP)
+        self.verify_fetchipinfo_calls(2)
+        self.assertEqual(self.cache.GetTTLStats()["SavedFetches"], 2)
+
+    def test_saved_fetches_no_lock(self):
+        """TTL, saved fetches counted without locking"""
+        self.cache = self.new_cache(FixedTTLPolicy(1000))
+        self.cache.GetIPInformation(self.IP)
+        self.age(150)
+
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            with self.cache._lock:
+                locked.set()
+                release.wait(5)
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        try:
+            locked.wait(5)
+            start = time()
+            self.cache.GetIPInformation(self.IP)
+            self.assertLess(time() - start, 1)
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(self.cache.GetTTLStats()["SavedFetches"], 1)
+
+    def test_saved_fetches_race(self):
+        """TTL, saved fetches of a replaced entry counted once"""
+        self.cache = self.new_cache(FixedTTLPolicy(1000))
+        now = time()
+        self.cache.GetIPInformation(self.IP)
+        TS = self.cache.IPPrefixesCache[self.PREFIX]["TS"]
+
+        with mock.patch("time.time", return_value=now + 150):
+            self.cache.GetIPInformation(self.IP)
+        with mock.patch("time.time", return_value=now + 1100):
+            self.cache.GetIPInformation(self.IP)
+        self.verify_fetchipinfo_calls(2)
+        self.assertEqual(self.cache.GetTTLStats()["SavedFetches"], 1)
+
+        # lookups of the old entry that raced with the refresh
+        self.cache._count_saved_fetch(self.PREFIX, TS, now + 1200)
+        self.cache._saved_fetches[self.PREFIX] = (TS, 1, 2)
+        self.assertEqual(self.cache.GetTTLStats()["SavedFetches"], 1)
+
+        with mock.patch("time.time", return_value=now + 2200):
+            self.cache.GetIPInformation(self.IP)
+        self.verify_fetchipinfo_calls(3)
+        self.assertEqual(self.cache.GetTTLStats()["SavedFetches"], 1)
+
+    def test_no_policy(self):
+        """TTL, no policy"""
+        self.cache = self.new_cache(None)
+        res = self.cache.GetIPInformation(self.IP)
+        self.assertIsNone(res.TTL)
+        self.assertNotIn("TTL", self.cache.IPPrefixesCache[self.PREFIX])
+
+        self.age(150)
+        self.cache.GetIPInformation(self.IP)
+        self.verify_fetchipinfo_calls(2)
+        self.assertEqual(self.cache.GetTTLStats(),
+                         {"Refreshes": 0, "Changes": 0, "SavedFetches": 0,
+                          "ExtraFetches": 0})
+
+    def test_adaptive(self):
+        """TTL, adaptive policy"""
+        self.cache = self.new_cache(
+            AdaptiveTTLPolicy(min_ttl=50, initial_ttl=100, max_ttl=400)
+        )
+        self.cache.GetIPInformation(self.IP)
+
+        # stable: TTL extended
+        self.age(150)
+        res = self.cache.GetIPInformation(self.IP)
+        self.verify_fetchipinfo_calls(2)
+        self.assertEqual(res.TTL, 200)
+        self.assertEqual(self.cache.IPPrefixesCache[self.PREFIX]["Stable"], 1)
+
+        self.age(150)
+        self.assertIs(self.cache.GetIPInformation(self.IP).ASN, res.ASN)
+        self.verify_fetchipinfo_calls(2)
+
+        # changed: TTL reduced; age() would replace the entry and drop
+        # the saved fetch counted above, so time passes instead
+        self.results[self.IP]["data"]["asns"][0]["asn"] = 1
+        with mock.patch("time.time", return_value=time() + 100):
+            res = self.cache.GetIPInformation(self.IP)
+        self.verify_fetchipinfo_calls(3)
+        self.assertEqual(res.ASN, "1")
+        self.assertEqual(res.TTL, 50)
+
+        self.age(60)
+        self.cache.GetIPInformation(self.IP)
+        self.verify_fetchipinfo_calls(4)
+
+        self.assertEqual(self.cache.GetTTLStats(),
+                         {"Refreshes": 3, "Changes": 1, "SavedFetches": 1,
+                          "ExtraFetches": 1})
+
+    def test_persisted(self):
+        """TTL, persisted with the cache"""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            kwargs = {
+                "IP_ADDRESSES_CACHE_FILE": os.path.join(tmp_dir, "addr"),
+                "IP_PREFIXES_CACHE_FILE": os.path.join(tmp_dir, "pref"),
+                "ttl_policy": FixedTTLPolicy(1000)
+            }
+            cache = IPDetailsCache(**kwargs)
+            cache.GetIPInformation(self.IP)
+            cache.SaveCache()
+
+            cache = IPDetailsCache(dont_save_on_del=True, **kwargs)
+            self.assertEqual(cache.IPPrefixesCache[self.PREFIX]["TTL"], 1000)
+            self.assertEqual(cache.GetIPInformation(self.IP).TTL, 1000)
+            self.verify_fetchipinfo_calls(1)
+        finally:
+            shutil.rmtree(tmp_dir)